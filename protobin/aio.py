@@ -0,0 +1,110 @@
+import asyncio
+import collections
+
+
+class ProtobinProtocol(asyncio.Protocol):
+    """
+    asyncio.Protocol that decodes the frames received in a connection with a StreamDecoder.
+    Subclasses override frame_received, or an on_frame callback is given.
+    Replies sent with send are encoded in one buffer and written once per loop iteration.
+    """
+
+    def __init__(self, protocol, on_frame=None, codec=None):
+        self.protocol = protocol
+        self.decoder = protocol.stream_decoder(codec=codec)
+        self.on_frame = on_frame
+        self.transport = None
+        self.loop = None
+        self.pending = bytearray()
+        self.flush_handle = None
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    def connection_lost(self, exc):
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.transport = None
+
+    def data_received(self, data):
+        for name, frame in self.decoder.feed(data):
+            self.frame_received(name, frame)
+
+    def frame_received(self, name, data):
+        if self.on_frame:
+            self.on_frame(self, name, data)
+
+    def send(self, data, format_key):
+        """Encodes a frame in the pending buffer, it is written with the other replies of this loop iteration"""
+        self.protocol.encode_into(self.pending, data, format_key)
+        if self.flush_handle is None and not self.paused:
+            self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        if self.transport is None or not self.pending:
+            return
+        # the transport may keep the buffer, a new one is used for the next replies
+        data, self.pending = self.pending, bytearray()
+        self.transport.write(data)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.flush()
+
+
+class FrameReader:
+    """
+    Reads decoded frames from an asyncio.StreamReader.
+    The codec of the frames without header can be changed between reads with decoder.codec,
+    for example after the login of a teltonika device.
+    """
+
+    def __init__(self, reader, protocol, codec=None, chunk_size=65536):
+        self.reader = reader
+        self.decoder = protocol.stream_decoder(codec=codec)
+        self.chunk_size = chunk_size
+        self.frames = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.read_frame()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    async def read_frame(self):
+        """Returns the next (format_name, data) frame, or None when the connection is closed"""
+        while not self.frames:
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                return None
+            self.frames.extend(self.decoder.feed(chunk))
+        return self.frames.popleft()
+
+
+class FrameWriter:
+    """Encodes frames for an asyncio.StreamWriter, the frames sent before a drain are written together"""
+
+    def __init__(self, writer, protocol):
+        self.writer = writer
+        self.protocol = protocol
+        self.pending = bytearray()
+
+    def send(self, data, format_key):
+        self.protocol.encode_into(self.pending, data, format_key)
+
+    async def drain(self):
+        if self.pending:
+            data, self.pending = self.pending, bytearray()
+            self.writer.write(data)
+        await self.writer.drain()
+
@@ -0,0 +1,241 @@
+"""
+Benchmarks of protobin, run them with:
+
+    python -m protobin.bench all --save baseline.json
+    python -m protobin.bench formats --compare baseline.json
+
+Every case reports operations per second, bytes per second and the peak of memory allocated by one operation.
+The suites are crc (CRC backends), fields (encode and decode of every field type) and formats (every format of
+the protocol files, by default tests/codec8.json, tests/teltonika.json and tests/demo.json, with arrays of
+several sizes). Those files are in the repository but not in the installed package, outside of a checkout the
+formats suite needs --protocol.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from protobin.crc import CRC_BACKENDS, make_crc
+from protobin.fields import ArrayField, BinaryField, BitsField, BoolField, CharField, DateField, DateTimeField, \
+    FlagsField, FloatField, IdField, SignedField, StringField, TimeField, TimestampField, UnsignedField, FIELD_MAP
+from protobin.protocol import Protocol
+
+# CRC-16/IBM as it is configured in tests/codec8.json
+CODEC8_CRC = {'poly': '0x18005', 'init': '0x0000', 'reverse': True}
+
+TESTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+PROTOCOL_FILES = ['codec8.json', 'teltonika.json', 'demo.json']
+
+FIELD_SAMPLES = {
+    'array': {'type': 'array', 'array': {'id': {'type': 'unsigned', 'bytes': 2}, 'name': {'type': 'string'}}},
+    'binary': {'type': 'binary'},
+    'bits': {'type': 'bits', 'length': 12},
+    'bool': {'type': 'bool'},
+    'char': {'type': 'char', 'bytes': 4},
+    'date': {'type': 'date'},
+    'datetime': {'type': 'datetime'},
+    'flags': {'type': 'flags'},
+    'float': {'type': 'float', 'bytes': 4, 'decimals': 6},
+    'id': {'type': 'id', 'bytes': 2},
+    'signed': {'type': 'signed', 'bytes': 2},
+    'string': {'type': 'string'},
+    'time': {'type': 'time'},
+    'timestamp': {'type': 'timestamp', 'bytes': 6, 'decimals': 3},
+    'unsigned': {'type': 'unsigned', 'bytes': 4},
+}
+
+
+def measure(function, size, min_time=0.2):
+    """Runs function for at least min_time seconds, returns operations and bytes per second"""
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    ops = number / elapsed
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ops': ops, 'bytes': ops * size, 'alloc': peak}
+
+
+def sample_value(field, size):
+    """Returns a valid value for a field, the arrays have size elements and the nested arrays two"""
+    if isinstance(field, ArrayField):
+        return [sample_data(field.fields, 2) for i in range(size)]
+    if isinstance(field, FlagsField):
+        return {k: i % 2 == 0 for i, k in enumerate(field.keys)}
+    if isinstance(field, BitsField):
+        return [i % 3 == 0 for i in range(field.length or 10)]
+    if isinstance(field, BinaryField):
+        return bytes(range(16))
+    if isinstance(field, (CharField, StringField)):
+        return 'ABCDEFGHIJ'[:field.bytes or 10]
+    if isinstance(field, BoolField):
+        return True
+    if isinstance(field, DateField):
+        return datetime.date(2024, 9, 13)
+    if isinstance(field, (DateTimeField, TimestampField)):
+        return datetime.datetime(2024, 9, 13, 15, 23, 51)
+    if isinstance(field, TimeField):
+        return datetime.time(15, 23)
+    if isinstance(field, FloatField):
+        return -12.061365 if field.bytes >= 4 else 1.5
+    if isinstance(field, SignedField):
+        return -100
+    if isinstance(field, (IdField, UnsignedField)):
+        return 100 if field.bytes == 1 else 1000
+    raise ValueError(f'There is no sample value for {field}')
+
+
+def sample_data(fields, size):
+    data = {}
+    for f in fields:
+        val = sample_value(f, size)
+        if f.keys:
+            data.update(val)
+        else:
+            data[f.key] = val
+    return data
+
+
+def bench_crc(sizes=(64, 1280, 65536), backends=None, min_time=0.2):
+    results = []
+    for name in backends or CRC_BACKENDS:
+        engine = make_crc(CODEC8_CRC, name)
+        for size in sizes:
+            data = memoryview((bytes(range(256)) * (size // 256 + 1))[:size])
+            result = measure(lambda: engine(data), size, min_time)
+            result.update({'name': f'crc.{name}', 'size': size})
+            results.append(result)
+    return results
+
+
+def bench_format(name, encoder, decoder, data, min_time=0.2):
+    """Benchmarks the encode and decode of a format, encoder and decoder are the protocols of both sides"""
+    binary = encoder.encode(data, name)
+    format = decoder.formats[name]
+    if format.header or (format.codec and decoder.crc16):
+        decode = lambda: decoder.decode(binary)
+    else:
+        decode = lambda: decoder.decode(binary, name)
+    results = []
+    for op, function in (('encode', lambda: encoder.encode(data, name)), ('decode', decode)):
+        result = measure(function, len(binary), min_time)
+        result.update({'name': f'{name}.{op}', 'size': len(binary)})
+        results.append(result)
+    return results
+
+
+def bench_fields(types=None, min_time=0.2):
+    results = []
+    for type in types or FIELD_MAP:
+        key = 'a,b,c,d,e,f,g,h,i,j' if type == 'flags' else 'test'
+        protocol = Protocol(js={'formats': {type: {'fields': {key: FIELD_SAMPLES[type]}}}})
+        data = sample_data(protocol.formats[type].output_fields, 10)
+        for result in bench_format(type, protocol, protocol, data, min_time):
+            result['name'] = f'field.{result["name"]}'
+            results.append(result)
+    return results
+
+
+def protocol_pair(path):
+    """Returns the protocols that encode and decode the formats of a file"""
+    try:
+        protocol = Protocol(file=path)
+        return protocol, protocol
+    except KeyError:
+        # formats with client and server fields
+        return Protocol(file=path, server=False), Protocol(file=path, server=True)
+
+
+def default_protocols():
+    """Returns the protocol files of the tests, they are only in a checkout of the repository"""
+    paths = [os.path.join(TESTS_PATH, p) for p in PROTOCOL_FILES]
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        raise FileNotFoundError(f'The protocol files of the tests are not installed with the package, '
+                                f'{", ".join(missing)} not found, pass the files to benchmark with --protocol')
+    return paths
+
+
+def bench_formats(paths=None, sizes=(1, 10, 50), min_time=0.2):
+    results = []
+    for path in paths or default_protocols():
+        encoder, decoder = protocol_pair(path)
+        file = os.path.basename(path)
+        for name, format in encoder.formats.items():
+            has_array = any(isinstance(f, ArrayField) for f in format.output_fields)
+            for size in sizes if has_array else sizes[:1]:
+                data = sample_data(format.output_fields, size)
+                for result in bench_format(name, encoder, decoder, data, min_time):
+                    result['name'] = f'format.{file}.{result["name"]}' + (f'[{size}]' if has_array else '')
+                    results.append(result)
+    return results
+
+
+def print_results(results, baseline=None):
+    baseline = baseline or {}
+    for r in results:
+        line = f"{r['name']:<48} {r['size']:>8} B {r['ops']:>12,.0f} ops/s {r['bytes'] / 1e6:>9.2f} MB/s " \
+               f"{r['alloc']:>9,} B alloc"
+        if r['name'] in baseline:
+            line += f" {r['ops'] / baseline[r['name']]['ops'] - 1:>+8.1%}"
+        print(line)
+
+
+def regressions(results, baseline, threshold):
+    """Returns the names of the cases that are slower than the baseline by more than threshold"""
+    return [r['name'] for r in results
+            if r['name'] in baseline and r['ops'] < baseline[r['name']]['ops'] * (1 - threshold)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m protobin.bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('suite', choices=['all', 'crc', 'fields', 'formats'])
+    parser.add_argument('--backend', action='append', choices=list(CRC_BACKENDS), help='CRC backends of the crc suite')
+    parser.add_argument('--protocol', action='append', help='protocol files of the formats suite')
+    parser.add_argument('--sizes', default='1,10,50', help='array sizes of the formats suite')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds measured by case')
+    parser.add_argument('--save', help='saves the results as a JSON baseline')
+    parser.add_argument('--compare', help='compares the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as regression')
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.suite in ('all', 'crc'):
+        results += bench_crc(backends=args.backend, min_time=args.min_time)
+    if args.suite in ('all', 'fields'):
+        results += bench_fields(min_time=args.min_time)
+    if args.suite in ('all', 'formats'):
+        sizes = tuple(int(s) for s in args.sizes.split(','))
+        try:
+            results += bench_formats(args.protocol or default_protocols(), sizes, args.min_time)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version, 'results': results}, f, indent=2)
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print(f'{len(slower)} regressions: {", ".join(slower)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import collections.abc
+
+# the 8 bits of every byte, most significant first
+BYTE_BITS = [tuple(bool(byte >> (7 - i) & 1) for i in range(8)) for byte in range(256)]
+# byte of every run of 8 bytes 0 or 1, the inverse of BYTE_BITS
+PACK_BYTES = {bytes(bits): byte for byte, bits in enumerate(BYTE_BITS)}
+# maps every non zero byte to 1
+ONES = bytes([0] + [1] * 255)
+# shorter lists are faster packed bit by bit than with PACK_BYTES
+PACK_THRESHOLD = 24
+
+
+def unpack_bits(binary, length):
+    """Returns the first length bits of binary as a list of bools"""
+    bits = []
+    for byte in binary:
+        bits += BYTE_BITS[byte]
+    del bits[length:]
+    return bits
+
+
+def pack_bits(val):
+    """Packs a list of truthy values in bytes, the first one is the most significant bit, the last byte is padded"""
+    if len(val) < PACK_THRESHOLD:
+        number = 0
+        for b in val:
+            number = number << 1 | (1 if b else 0)
+        return (number << (-len(val) % 8)).to_bytes((len(val) + 7) // 8, 'big')
+    try:
+        flat = bytes(val).translate(ONES)
+    except (TypeError, ValueError):
+        flat = bytes(1 if b else 0 for b in val)
+    flat += bytes(-len(flat) % 8)
+    return bytes([PACK_BYTES[flat[i:i + 8]] for i in range(0, len(flat), 8)])
+
+
+class Bitset(collections.abc.Sequence):
+    """
+    Bits backed by the bytes of the message, they are read on access without building a list of bools.
+    int(bitset) is the bits packed in an integer, the first bit is the most significant.
+    """
+    __slots__ = ('data', 'length')
+
+    def __init__(self, data, length):
+        self.data = bytes(data)
+        self.length = length
+
+    def __repr__(self):
+        return f'Bitset<{"".join("1" if b else "0" for b in self)}>'
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.to_list()[i]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(f'Bitset has {self.length} bits')
+        return bool(self.data[i >> 3] >> (7 - (i & 7)) & 1)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __int__(self):
+        return int.from_bytes(self.data, 'big', signed=False) >> (-self.length % 8)
+
+    def __eq__(self, other):
+        if isinstance(other, Bitset):
+            return self.length == other.length and int(self) == int(other)
+        if isinstance(other, collections.abc.Sequence) and not isinstance(other, (str, bytes)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def to_list(self):
+        return unpack_bits(self.data, self.length)
+
+    def to_bytes(self):
+        """Returns the bits as they are encoded, with the padding of the last byte cleared"""
+        return (int(self) << (-self.length % 8)).to_bytes(len(self.data), 'big')
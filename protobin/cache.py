@@ -0,0 +1,77 @@
+import functools
+import hashlib
+import os
+import pickle
+import sys
+
+# format of the compiled files, the changes of the pickled classes are detected by package_digest
+CACHE_VERSION = 5
+CACHE_FOLDER = '__protobin__'
+DIGEST_SIZE = 32
+
+
+def compiled_path(path, server):
+    """Returns the path of the compiled protocol of a file, in a __protobin__ folder next to it"""
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, CACHE_FOLDER, f'{name}.{server}.pickle')
+
+
+@functools.lru_cache(maxsize=None)
+def package_digest():
+    """Hash of the sources of protobin, the pickled protocol depends on every class of the package"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    try:
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.py'):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    digest.update(name.encode('utf') + b'\0' + f.read())
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def source_stamp(path, options):
+    """Identifies the version of the source file, of protobin and the options the protocol was built with"""
+    stat = os.stat(path)
+    return {'version': CACHE_VERSION, 'package': package_digest(), 'python': sys.implementation.cache_tag,
+            'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'options': options}
+
+
+def load_compiled(path, options):
+    """
+    Returns the compiled protocol of a file, None when it was not compiled yet or the file changed.
+    The stamp is pickled before the protocol, so an outdated protocol is not unpickled, and the digest of
+    the pickled protocol detects a corrupted file.
+    """
+    try:
+        stamp = source_stamp(path, options)
+        with open(compiled_path(path, options['server']), 'rb') as f:
+            if pickle.load(f) != stamp:
+                return None
+            digest = f.read(DIGEST_SIZE)
+            body = f.read()
+        if hashlib.sha256(body).digest() != digest:
+            return None
+        return pickle.loads(body)
+    except Exception:
+        # a missing, truncated or corrupted file is compiled and saved again
+        return None
+
+
+def save_compiled(path, options, protocol):
+    """Saves the compiled protocol next to its file, a read-only folder or an error pickling only skip the cache"""
+    compiled = compiled_path(path, options['server'])
+    tmp = f'{compiled}.{os.getpid()}'
+    try:
+        stamp = source_stamp(path, options)
+        os.makedirs(os.path.dirname(compiled), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            body = pickle.dumps(protocol, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(stamp, f, pickle.HIGHEST_PROTOCOL)
+            f.write(hashlib.sha256(body).digest())
+            f.write(body)
+        os.replace(tmp, compiled)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
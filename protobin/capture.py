@@ -0,0 +1,187 @@
+import array
+import mmap
+import os
+import struct
+
+from protobin.errors import FormatError, InputError
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PBIX'
+INDEX_VERSION = 1
+# magic, version and the size of the capture covered by the index
+INDEX_HEADER = struct.Struct('<4sIQ')
+
+
+def check_protocol(protocol):
+    if not protocol.crc16:
+        raise FormatError('Capture files need a protocol with length and crc')
+
+
+class CaptureWriter:
+    """
+    Appends frames to a capture file, in the same layout encode produces with length and crc.
+    Frames are buffered and written every buffer_size bytes, the file is fsynced every sync_every frames
+    and when it is closed.
+    """
+
+    def __init__(self, path, protocol, sync_every=1000, buffer_size=1 << 16):
+        check_protocol(protocol)
+        self.path = path
+        self.protocol = protocol
+        self.sync_every = sync_every
+        self.buffer_size = buffer_size
+        self.file = open(path, 'ab')
+        self.buffer = bytearray()
+        self.unsynced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, data, format_key):
+        format = self.protocol.formats.get(format_key)
+        if format is not None and (not format.crc or self.protocol.fake_prefix and format.header):
+            # encode does not prefix them with their length, the reader could not frame them
+            raise InputError(f'{format_key} is not encoded with length and crc, it can not be captured')
+        self.protocol.encode_into(self.buffer, data, format_key)
+        self.written()
+
+    def write_frame(self, binary):
+        """Appends a frame already encoded, like the ones received from a device"""
+        protocol = self.protocol
+        length = int.from_bytes(binary[:protocol.length], 'big', signed=False)
+        if len(binary) != protocol.length + length + protocol.crc_size:
+            raise InputError(f'The frame of {len(binary)} bytes does not match its length prefix {length}')
+        self.buffer += binary
+        self.written()
+
+    def written(self):
+        self.unsynced += 1
+        if len(self.buffer) >= self.buffer_size or self.unsynced >= self.sync_every:
+            self.flush(sync=self.unsynced >= self.sync_every)
+
+    def flush(self, sync=True):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+        self.file.flush()
+        if sync and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class CaptureReader:
+    """
+    Memory-mapped reader of a capture file, the frames are decoded only when they are accessed,
+    by index (reader[i], reader[-1]) or iterating it.
+    The offsets of the frames are kept in a sidecar index file, path + '.idx', which is extended
+    when frames are appended to the capture. An incomplete frame at the end of the file is not indexed.
+    """
+
+    def __init__(self, path, protocol, codec=None, columnar=False, index=True):
+        check_protocol(protocol)
+        self.path = path
+        self.protocol = protocol
+        self.codec = codec
+        self.columnar = columnar
+        self.index_path = path + INDEX_SUFFIX if index else None
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # an empty file can not be mapped
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.view = memoryview(self.mmap)
+        self.offsets = self.load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.frame_range(i)
+        with self.view[start:end] as binary:
+            return self.protocol.decode(binary, self.codec, self.columnar)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def frame(self, i):
+        """Returns the raw frame i as bytes"""
+        start, end = self.frame_range(i)
+        return bytes(self.view[start:end])
+
+    def frame_range(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'Capture {self.path} has {len(self)} frames')
+        return self.offsets[i], self.offsets[i + 1]
+
+    def load_index(self):
+        offsets = array.array('Q', [0])
+        if self.index_path and os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                body = f.read()
+            # a truncated or corrupted index is rebuilt like a missing one
+            if len(header) == INDEX_HEADER.size and body and len(body) % offsets.itemsize == 0:
+                magic, version, indexed = INDEX_HEADER.unpack(header)
+                if magic == INDEX_MAGIC and version == INDEX_VERSION and indexed <= len(self.view):
+                    loaded = array.array('Q')
+                    loaded.frombytes(body)
+                    if loaded[0] == 0 and loaded[-1] == indexed:
+                        offsets = loaded
+            if len(offsets) > 1 and self.frame_end(offsets[-2]) != offsets[-1]:
+                # the capture was replaced, its last indexed frame is not there anymore
+                offsets = array.array('Q', [0])
+        indexed = offsets[-1]
+        self.scan(offsets)
+        if self.index_path and offsets[-1] != indexed:
+            self.save_index(offsets)
+        return offsets
+
+    def scan(self, offsets):
+        """Appends the end offsets of the frames after the last indexed one, only the length prefixes are read"""
+        size = len(self.view)
+        offset = offsets[-1]
+        while offset + self.protocol.length <= size:
+            end = self.frame_end(offset)
+            if end > size:
+                break
+            offsets.append(end)
+            offset = end
+
+    def frame_end(self, offset):
+        length = self.protocol.length
+        payload = int.from_bytes(self.view[offset:offset + length], 'big', signed=False)
+        return offset + length + payload + self.protocol.crc_size
+
+    def save_index(self, offsets):
+        tmp = f'{self.index_path}.{os.getpid()}'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, offsets[-1]))
+                offsets.tofile(f)
+            os.replace(tmp, self.index_path)
+        except OSError:
+            # a read-only folder only disables the index
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self.file.close()
@@ -0,0 +1,160 @@
+import hashlib
+import marshal
+import os
+import struct
+import sys
+
+from protobin.compiler import StructBlock
+from protobin.fields import ArrayField, BoolField, FloatField, IdField, StringField, TimestampField
+
+
+def default_cache_dir():
+    return os.environ.get('PROTOBIN_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'protobin'))
+
+
+class CodeGenerator:
+    """
+    Generates the python source of the encode and decode functions of every format of a protocol.
+    The fixed-width blocks, the arrays and the strings are inlined with their constants, the other fields
+    call the methods of their field objects, which are put in the namespace of the generated module.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {'struct_error': struct.error}
+        self.counter = 0
+
+    def add(self, prefix, obj):
+        name = f'_{prefix}{self.counter}'
+        self.counter += 1
+        self.namespace[name] = obj
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def generate(self, formats):
+        for i, format in enumerate(formats):
+            self.emit(0, f'def decode_{i}(binary, offset):')
+            self.emit(1, 'data = {}')
+            self.decode_plan(format.input_plan, 'data', 1, 0)
+            self.emit(1, 'return data, offset')
+            self.emit(0, '')
+            self.emit(0, f'def encode_{i}(buf, data):')
+            if format.prefix:
+                self.emit(1, f'buf += {format.prefix!r}')
+            elif not format.output_plan:
+                self.emit(1, 'pass')
+            self.encode_plan(format.output_plan, 'data', 1, 0)
+            self.emit(0, '')
+        return '\n'.join(self.lines) + '\n'
+
+    def decode_plan(self, plan, target, indent, depth):
+        for f in plan:
+            if isinstance(f, StructBlock):
+                block = self.add('block', f)
+                unpack = self.add('unpack', f.struct.unpack_from)
+                self.emit(indent, f'if len(binary) - offset < {f.bytes}:')
+                self.emit(indent + 1, f'{block}.decode_into(binary, offset, {target})')
+                self.emit(indent, f'v = {unpack}(binary, offset)')
+                for i, field in enumerate(f.fields):
+                    self.emit(indent, f'{target}[{field.key!r}] = {self.from_struct(field, f"v[{i}]")}')
+                self.emit(indent, f'offset += {f.bytes}')
+            elif isinstance(f, ArrayField):
+                item = f'item{depth}'
+                self.emit(indent, 'length = binary[offset]')
+                self.emit(indent, 'offset += 1')
+                self.emit(indent, f'lista{depth} = []')
+                self.emit(indent, f'for i{depth} in range(length):')
+                self.emit(indent + 1, f'{item} = {{}}')
+                self.decode_plan(f.plan, item, indent + 1, depth + 1)
+                self.emit(indent + 1, f'lista{depth}.append({item})')
+                self.emit(indent, f'{target}[{f.key!r}] = lista{depth}')
+            elif isinstance(f, StringField) and not f.bytes and f.length_size == 1:
+                self.emit(indent, 'end = offset + 1 + binary[offset]')
+                self.emit(indent, f"{target}[{f.key!r}] = str(binary[offset + 1:end], 'utf')")
+                self.emit(indent, 'offset = end')
+            elif f.keys:
+                self.emit(indent, f'offset = {self.add("decode", f.decode_into)}(binary, offset, {target})')
+            else:
+                self.emit(indent, f'{target}[{f.key!r}], offset = {self.add("decode", f.decode)}(binary, offset)')
+
+    def from_struct(self, field, val):
+        if field.from_struct is None:
+            return val
+        if isinstance(field, FloatField):
+            return f'{val} / {10 ** field.decimals}'
+        if isinstance(field, IdField):
+            return f'{val} or None'
+        if isinstance(field, BoolField):
+            return f'{self.add("bool", BoolField.from_struct)}({val})'
+        if isinstance(field, TimestampField) and field.output == 'int':
+            return val
+        return f'{self.add("conv", field.from_struct)}({val})'
+
+    def encode_plan(self, plan, source, indent, depth):
+        for f in plan:
+            if isinstance(f, StructBlock):
+                pack = self.add('pack', f.struct.pack)
+                values = ', '.join(f'{self.add("to", field.to_struct)}({source}.get({field.key!r}, {field.default!r}))'
+                                   for field in f.fields)
+                self.emit(indent, 'try:')
+                self.emit(indent + 1, f'buf += {pack}({values})')
+                self.emit(indent, 'except struct_error:')
+                self.emit(indent + 1, f'{self.add("block", f)}.encode_into(buf, {source})')
+            elif isinstance(f, ArrayField):
+                val = f'val{depth}'
+                item = f'item{depth}'
+                self.emit(indent, f'{val} = {source}.get({f.key!r})')
+                self.emit(indent, f'if not isinstance({val}, (list, tuple)):')
+                self.emit(indent + 1, f'{self.add("array", f)}.to_binary_into(buf, {val})')
+                self.emit(indent, f"buf += len({val}).to_bytes(1, 'big')")
+                self.emit(indent, f'for {item} in {val}:')
+                self.encode_plan(f.plan, item, indent + 1, depth + 1)
+            else:
+                self.emit(indent, f'{self.add("encode", f.encode_into)}(buf, {source})')
+
+
+def cache_key(source):
+    """The code is keyed by its own source, any change of the generator or of the protocol invalidates it"""
+    return hashlib.sha256(f'{sys.implementation.cache_tag}\n{source}'.encode('utf')).hexdigest()
+
+
+def load_code(source, key, cache_dir):
+    path = os.path.join(cache_dir, f'{key}.marshal') if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    code = compile(source, f'<protobin {key[:12]}>', 'exec')
+    if path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f'{path}.{os.getpid()}'
+            with open(tmp, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+    return code
+
+
+def install(protocol, cache_dir=None):
+    """
+    Generates and compiles the functions of the formats of a protocol and sets them in the formats.
+    The compiled code is cached in cache_dir keyed by a hash of the generated source, False disables the cache.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    formats = list(protocol.formats.values())
+    generator = CodeGenerator()
+    source = generator.generate(formats)
+    code = load_code(source, cache_key(source), cache_dir)
+    namespace = generator.namespace
+    exec(code, namespace)
+    for i, format in enumerate(formats):
+        format.decode_function = namespace[f'decode_{i}']
+        format.encode_function = namespace[f'encode_{i}']
+    protocol.generated_source = source
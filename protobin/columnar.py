@@ -0,0 +1,65 @@
+import array
+import functools
+
+# numpy is imported the first time a column needs it, it takes longer to import than protobin
+_numpy = False
+
+
+def get_numpy():
+    """Returns the numpy module, None when it is not installed"""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def integer_typecode(size, signed):
+    """Returns the typecode of the smallest integer that holds a field of size bytes"""
+    if not size:
+        return None
+    for bytes, code in ((1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q')):
+        if size <= bytes:
+            return code.lower() if signed else code
+    return None
+
+
+def make_column(values, typecode):
+    """
+    Converts the values of a column to a numpy array when numpy is installed, or to an array.array.
+    Columns without typecode, like ids and bools that can be None, stay as lists.
+    """
+    if typecode is None:
+        return values
+    numpy = get_numpy()
+    if numpy is not None:
+        return numpy.array(values, dtype=typecode)
+    return array.array(typecode, values)
+
+
+def element_layout(fields):
+    """
+    Returns the keys and big-endian struct codes of an array element made only of fixed-width fields,
+    None when a field has no struct code. make_dtype builds its numpy dtype when it is first needed.
+    """
+    codes = [f.get_struct_code() for f in fields]
+    if not all(codes):
+        return None
+    return tuple((f.key, '>' + code) for f, code in zip(fields, codes))
+
+
+@functools.lru_cache(maxsize=None)
+def make_dtype(layout):
+    """Returns the numpy structured dtype of an element layout, None when numpy is not installed"""
+    numpy = get_numpy()
+    if numpy is None:
+        return None
+    return numpy.dtype(list(layout))
+
+
+def native(column):
+    """Copies a big-endian numpy column to the native byte order, so it does not keep the frame buffer"""
+    return column.astype(column.dtype.newbyteorder('='))
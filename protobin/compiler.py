@@ -0,0 +1,86 @@
+import struct
+
+
+class StructBlock:
+    """
+    Run of consecutive fixed-width fields packed and unpacked with a single precompiled struct.Struct.
+    It exposes the same decode_into/encode interface as the fields so it can replace them inside a plan.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.keys = [f.key for f in fields]
+        self.key = ','.join(self.keys)
+        self.struct = struct.Struct('>' + ''.join(f.get_struct_code() for f in fields))
+        self.bytes = self.struct.size
+        self.converters = [(f.key, f.from_struct) for f in fields]
+
+    def __getstate__(self):
+        # struct.Struct is not picklable, it is compiled again from the fields
+        return {'fields': self.fields}
+
+    def __setstate__(self, state):
+        self.__init__(state['fields'])
+
+    def __repr__(self):
+        return f'StructBlock<keys: {self.keys}, format: {self.struct.format}>'
+
+    def decode_into(self, binary, offset, data):
+        if len(binary) - offset < self.bytes:
+            # let the fields raise the same DecodeError they raise alone
+            for f in self.fields:
+                offset = f.decode_into(binary, offset, data)
+        for (k, conv), val in zip(self.converters, self.struct.unpack_from(binary, offset)):
+            data[k] = conv(val) if conv else val
+        return offset + self.bytes
+
+    decode_columns_into = decode_into
+
+    def get_width(self):
+        return self.bytes
+
+    def get_size_range(self):
+        return self.bytes, self.bytes
+
+    def size_of(self, data):
+        return self.bytes
+
+    def skip(self, binary, offset):
+        return offset + self.bytes
+
+    def encode(self, data):
+        try:
+            return self.struct.pack(*[f.to_struct(data.get(f.key, f.default)) for f in self.fields])
+        except struct.error:
+            # out of range values, the fields raise the same error they raise alone
+            return b''.join(f.encode(data) for f in self.fields)
+
+    def encode_into(self, buf, data):
+        buf += self.encode(data)
+
+
+def compile_fields(fields):
+    """
+    Builds the codec plan of a list of fields, merging the runs of fixed-width fields into StructBlocks.
+    Single fixed-width fields are kept as they are because a one item struct does not save anything.
+    """
+    plan = []
+    run = []
+    for f in fields:
+        if not f._frozen:
+            f.compile()
+            f.freeze()
+        if f.get_struct_code():
+            run.append(f)
+            continue
+        plan.extend(_close_run(run))
+        run = []
+        plan.append(f)
+    plan.extend(_close_run(run))
+    return plan
+
+
+def _close_run(run):
+    if len(run) > 1:
+        return [StructBlock(run)]
+    return run
@@ -0,0 +1,128 @@
+import crcmod
+
+try:
+    from crcmod import _crcfunext
+except ImportError:
+    _crcfunext = None
+
+
+class CrcBase:
+    """
+    CRC engine of a polynomial. Engines are called like crcmod functions, engine(data, crc=None),
+    where data is any bytes-like object (bytes, bytearray, memoryview) and crc continues a previous value,
+    so a frame can be checksummed in parts while it arrives.
+    """
+    name = None
+
+    def __init__(self, poly, init, reverse):
+        self.poly = poly
+        self.init = init
+        self.reverse = reverse
+        self.width = poly.bit_length() - 1
+        self.mask = (1 << self.width) - 1
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}<poly: {hex(self.poly)}, init: {hex(self.init)}, reverse: {self.reverse}>'
+
+    def __call__(self, data, crc=None):
+        raise NotImplementedError()
+
+    def new(self):
+        return CrcState(self)
+
+
+class CrcState:
+    """Incremental CRC of an engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.value = engine.init
+
+    def update(self, data):
+        self.value = self.engine(data, self.value)
+        return self
+
+
+class CrcmodCrc(CrcBase):
+    """crcmod function, it uses the C extension of crcmod when it is compiled"""
+    name = 'crcmod'
+
+    def __init__(self, poly, init, reverse):
+        super().__init__(poly, init, reverse)
+        self.function = crcmod.mkCrcFun(poly, init, reverse)
+
+    def __getstate__(self):
+        # the crcmod function is not picklable, it is made again
+        return {'poly': self.poly, 'init': self.init, 'reverse': self.reverse}
+
+    def __setstate__(self, state):
+        self.__init__(state['poly'], state['init'], state['reverse'])
+
+    def __call__(self, data, crc=None):
+        if crc is None:
+            return self.function(data)
+        return self.function(data, crc)
+
+
+class TableCrc(CrcBase):
+    """Pure python CRC with a precomputed table of 256 entries, one lookup per byte"""
+    name = 'table'
+
+    def __init__(self, poly, init, reverse):
+        super().__init__(poly, init, reverse)
+        if self.width < 8:
+            raise ValueError(f'TableCrc needs a polynomial of 8 bits or more, {hex(poly)} received')
+        self.table = self.make_table()
+
+    def make_table(self):
+        width = self.width
+        poly = self.poly & self.mask
+        table = []
+        if self.reverse:
+            poly = int(format(poly, f'0{width}b')[::-1], 2)
+            for i in range(256):
+                crc = i
+                for _ in range(8):
+                    crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+                table.append(crc)
+        else:
+            top = 1 << (width - 1)
+            for i in range(256):
+                crc = i << (width - 8)
+                for _ in range(8):
+                    crc = ((crc << 1) ^ poly if crc & top else crc << 1) & self.mask
+                table.append(crc)
+        return tuple(table)
+
+    def __call__(self, data, crc=None):
+        if crc is None:
+            crc = self.init
+        table = self.table
+        if self.reverse:
+            for b in data:
+                crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+        else:
+            shift = self.width - 8
+            mask = self.mask
+            for b in data:
+                crc = ((crc << 8) & mask) ^ table[((crc >> shift) ^ b) & 0xFF]
+        return crc
+
+
+CRC_BACKENDS = {
+    'crcmod': CrcmodCrc,
+    'table': TableCrc,
+}
+
+
+def default_backend():
+    # crcmod without its C extension is slower than the table
+    return 'crcmod' if _crcfunext is not None else 'table'
+
+
+def make_crc(js, backend=None):
+    """Builds the CRC engine of the crc configuration of a protocol"""
+    backend = backend or js.get('backend') or default_backend()
+    if backend not in CRC_BACKENDS:
+        raise ValueError(f'Invalid CRC backend {backend}, these are the available backends {list(CRC_BACKENDS)}')
+    return CRC_BACKENDS[backend](int(js['poly'], 16), int(js['init'], 16), js['reverse'])
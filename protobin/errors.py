@@ -12,6 +12,10 @@ class BaseError(Exception):
     def get_message(self):
         return self._message
 
+    def __reduce__(self):
+        # errors are pickled to be sent between processes
+        return self.__class__, (self._message,)
+
 
 class FormatError(BaseError):
     pass
@@ -1,8 +1,12 @@
 import enum
 import datetime
+import functools
 import math
 from typing import Union, List
 
+from protobin.bits import BYTE_BITS, Bitset, pack_bits, unpack_bits
+from protobin.columnar import element_layout, get_numpy, integer_typecode, make_column, make_dtype, native
+from protobin.compiler import StructBlock, compile_fields
 from protobin.errors import DecodeError, FormatError
 
 
@@ -24,32 +28,158 @@ from protobin.errors import DecodeError, FormatError
 #     UNSIGNED = 'unsigned'
 
 
+UNSIGNED_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+SIGNED_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+BITS_OUTPUTS = ('list', 'int', 'bitset')
+TIMESTAMP_OUTPUTS = ('datetime', 'int')
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# value of every BCD byte, the nibbles above 9 are decoded as they were always decoded, 0xff is 165
+BCD_DECODE = [(b >> 4) * 10 + (b & 0xf) for b in range(256)]
+BCD_ENCODE = [(n // 10) * 16 + n % 10 for n in range(100)]
+# dates and times kept by the fields declared with cache, consecutive messages usually share them
+BCD_CACHE_SIZE = 64
+
+
+def to_bcd(n):
+    if 0 <= n < 100:
+        return BCD_ENCODE[n]
+    return int(int(n / 10) * 16 + n % 10)
+
+
+def bcd_date(d, m, y):
+    if not (d or m or y):
+        return None
+    return datetime.date(2000 + BCD_DECODE[y], BCD_DECODE[m], BCD_DECODE[d])
+
+
+def bcd_datetime(d, m, y, H, M, S):
+    if not (d or m or y or H or M or S):
+        return None
+    return datetime.datetime(2000 + BCD_DECODE[y], BCD_DECODE[m], BCD_DECODE[d],
+                             BCD_DECODE[H], BCD_DECODE[M], BCD_DECODE[S])
+
+
+def bcd_time(H, M):
+    if not (H or M):
+        return None
+    return datetime.time(BCD_DECODE[H], BCD_DECODE[M])
+
+
+cached_bcd_date = functools.lru_cache(maxsize=BCD_CACHE_SIZE)(bcd_date)
+cached_bcd_datetime = functools.lru_cache(maxsize=BCD_CACHE_SIZE)(bcd_datetime)
+cached_bcd_time = functools.lru_cache(maxsize=BCD_CACHE_SIZE)(bcd_time)
+
+
 class FieldBase:
+    """
+    Base of the fields. The constants used for every value are computed when the field is created and
+    the field is frozen after its protocol is compiled, so the fields of a protocol can be shared by threads.
+    """
+    __slots__ = ('key', 'keys', 'type', 'bytes', '_frozen')
     # removed for python 3.8
     # bytes: int | None
     # keys: List[str] | None
     # key: str
     # type: FieldEnum
+    default = None
+    # conversion applied to the value unpacked by a StructBlock, None keeps the integer as is
+    from_struct = None
+    # attributes that can still be tuned after the field is frozen
+    tunable = ()
 
     def __init__(self, k, js):
+        self._frozen = False
         self.key = k
         self.keys = None
         self.type = js['type']
         self.bytes = js.get('bytes')
 
-    def decode(self, binary):
-        self.ensure_length(binary)
-        a, b = self.split(binary)
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False) and name not in self.tunable:
+            raise AttributeError(f'{self} is frozen, {name} can not be changed')
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def freeze(self):
+        self._frozen = True
+
+    def decode(self, binary, offset=0):
+        """
+        Decodes the field starting at offset, binary can be bytes, bytearray or memoryview.
+        Only the bytes of the value are sliced, returns the value and the offset of the next field.
+        """
+        self.ensure_length(binary, offset)
+        a, offset = self.split(binary, offset)
         val = self.from_binary(a)
-        return val, b
+        return val, offset
+
+    def decode_into(self, binary, offset, data):
+        val, offset = self.decode(binary, offset)
+        if self.keys:
+            for k in self.keys:
+                data[k] = val[k]
+        else:
+            data[self.key] = val
+        return offset
+
+    def decode_columns_into(self, binary, offset, data):
+        """Same as decode_into, but the arrays are decoded as columns"""
+        return self.decode_into(binary, offset, data)
 
     def encode(self, data):
-        val = data.get(self.key)
+        val = data.get(self.key, self.default)
         return self.to_binary(val)
 
-    def ensure_length(self, binary):
+    def encode_into(self, buf, data):
+        """Appends the encoded field to the bytearray buf"""
+        buf += self.encode(data)
+
+    def compile(self):
+        pass
+
+    def get_struct_code(self):
+        """Returns the struct format character when the field can be packed by a StructBlock"""
+        return None
+
+    def get_array_typecode(self):
+        """Returns the array.array typecode of the column of the field, None for a list"""
+        return None
+
+    def from_vector(self, column):
+        """Converts the numpy column of the field decoded by ArrayField.decode_vector"""
+        return [self.from_struct(v) for v in column.tolist()]
+
+    def get_width(self):
+        """Returns the number of bytes of the field when it does not depend on the value, None otherwise"""
+        return self.bytes or None
+
+    def get_size_range(self):
+        """Returns the minimum and maximum number of bytes of the field, the maximum is None when it is unbounded"""
+        width = self.get_width()
+        return width, width
+
+    def size_of(self, data):
+        """Returns the number of bytes encode(data) produces, without encoding the fixed-width fields"""
+        width = self.get_width()
+        if width is not None:
+            return width
+        return len(self.encode(data))
+
+    def skip(self, binary, offset):
+        """Returns the offset of the next field without decoding this one"""
+        return self.split(binary, offset)[1]
+
+    def ensure_length(self, binary, offset=0):
         if self.bytes:
-            if len(binary) < self.bytes:
+            if len(binary) - offset < self.bytes:
                 raise DecodeError(f'Binary has not enough data for {self}')
 
     def from_binary(self, binary):
@@ -63,7 +193,7 @@ class FieldBase:
 
     @staticmethod
     def get_nible(binary):
-        hexa = ord(binary[0:1])
+        hexa = binary[0]
         lo = hexa % 16
         hi = hexa // 16
         nible = hi * 10 + lo
@@ -77,14 +207,18 @@ class FieldBase:
         units = n % 10
         return int(tens * 16 + units)
 
-    def split(self, binary):
+    def split(self, binary, offset):
         if self.bytes:
-            return binary[:self.bytes], binary[self.bytes:]
-        return binary[1:binary[0] + 1], binary[binary[0] + 1:]
+            end = offset + self.bytes
+            return binary[offset:end], end
+        end = offset + 1 + binary[offset]
+        return binary[offset + 1:end], end
 
 
 class ArrayField(FieldBase):
+    __slots__ = ('fields', 'plan', 'layout', 'stride', 'packed_size', 'sized_fields', 'vector_threshold')
     length: int
+    tunable = ('vector_threshold',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -94,44 +228,133 @@ class ArrayField(FieldBase):
                 raise FormatError(f'Invalid protobin type {f["type"]}')
             fields.append(FIELD_MAP[f['type']](k, f))
         self.fields = fields
+        self.plan = fields
+        # keys and struct codes of an element decoded with numpy
+        self.layout = None
+        # bytes of an element when all its fields are fixed-width
+        self.stride = None
+        # encoded bytes of the packed fields of an element and the fields whose size depends on the value
+        self.packed_size = 0
+        self.sized_fields = fields
+        # minimum number of elements decoded with numpy, smaller arrays are faster element by element
+        self.vector_threshold = 16
 
     def __repr__(self):
         return f'ArrayField<key: {self.key}>'
 
-    def decode(self, binary):
-        length = binary[0]
-        binary = binary[1:]
-        val, binary = self.from_binary(binary, length)
-        return val, binary
+    def compile(self):
+        self.plan = compile_fields(self.fields)
+        self.layout = element_layout(self.fields)
+        widths = [f.get_width() for f in self.plan]
+        self.stride = sum(widths) if all(widths) else None
+        # a fixed string takes its bytes when decoded but is encoded without padding
+        self.packed_size = 0
+        self.sized_fields = []
+        for f in self.plan:
+            if isinstance(f, StructBlock) or f.get_struct_code():
+                self.packed_size += f.get_width()
+            else:
+                self.sized_fields.append(f)
+
+    def get_width(self):
+        return None
+
+    def get_size_range(self):
+        maximum = 0
+        for f in self.plan:
+            top = f.get_size_range()[1]
+            if top is None:
+                return 1, None
+            maximum += top
+        return 1, 1 + 255 * maximum
+
+    def size_of(self, data):
+        val = data.get(self.key)
+        if not isinstance(val, (list, tuple)):
+            raise ValueError(f'Error in field ArrayField<{self.key}>, a array is expected but "{val}" is received, {type(val)}')
+        return 1 + len(val) * self.packed_size + sum(f.size_of(item) for item in val for f in self.sized_fields)
+
+    def skip(self, binary, offset):
+        length = binary[offset]
+        offset += 1
+        if self.stride is not None:
+            return offset + length * self.stride
+        for i in range(length):
+            for f in self.plan:
+                offset = f.skip(binary, offset)
+        return offset
+
+    def decode(self, binary, offset=0):
+        length = binary[offset]
+        return self.from_binary(binary, length, offset + 1)
+
+    def decode_columns_into(self, binary, offset, data):
+        data[self.key], offset = self.decode_columns(binary, offset)
+        return offset
+
+    def decode_columns(self, binary, offset=0):
+        """
+        Decodes the array as a dict of columns, one per key, instead of a list of dicts.
+        Every element is decoded in the same scratch dict and its values are appended to the columns.
+        Nested arrays are a column of lists of dicts, many tiny columns would cost more than the dicts.
+        """
+        length = binary[offset]
+        offset += 1
+        if self.layout is not None and length >= self.vector_threshold:
+            dtype = make_dtype(self.layout)
+            end = offset + length * self.stride
+            if dtype is not None and end <= len(binary):
+                return self.decode_vector(binary, offset, length, dtype), end
+        columns = {}
+        typecodes = {}
+        for f in self.fields:
+            for k in f.keys or [f.key]:
+                columns[k] = []
+                typecodes[k] = f.get_array_typecode()
+        appends = [(k, column.append) for k, column in columns.items()]
+        row = {}
+        for i in range(length):
+            for f in self.plan:
+                offset = f.decode_into(binary, offset, row)
+            for k, append in appends:
+                append(row[k])
+        return {k: make_column(column, typecodes[k]) for k, column in columns.items()}, offset
+
+    def decode_vector(self, binary, offset, length, dtype):
+        """Decodes the columns of an array of fixed-width elements at once with numpy.frombuffer"""
+        elements = get_numpy().frombuffer(binary, dtype, length, offset)
+        return {f.key: f.from_vector(elements[f.key]) for f in self.fields}
+
+    def encode_into(self, buf, data):
+        self.to_binary_into(buf, data.get(self.key))
 
     def to_binary(self, val):
+        buf = bytearray()
+        self.to_binary_into(buf, val)
+        return bytes(buf)
+
+    def to_binary_into(self, buf, val):
         if not isinstance(val, (list, tuple)):
             raise ValueError(f'Error in field ArrayField<{self.key}>, a array is expected but "{val}" is received, {type(val)}')
-        binary = b''
         length = len(val)
-        binary += length.to_bytes(1, 'big')
+        buf += length.to_bytes(1, 'big')
         for i in range(length):
-            for f in self.fields:
-                binary += f.encode(val[i])
-        return binary
+            for f in self.plan:
+                f.encode_into(buf, val[i])
 
-    def from_binary(self, binary, length):
+    def from_binary(self, binary, length, offset=0):
         lista = []
         for i in range(length):
             data = {}
-            for f in self.fields:
-                val, binary = f.decode(binary)
-                if f.keys:
-                    for k, v in val.items():
-                        data[k] = v
-                else:
-                    data[f.key] = val
+            for f in self.plan:
+                offset = f.decode_into(binary, offset, data)
             lista.append(data)
-        return lista, binary
+        return lista, offset
 
 
 
 class BinaryField(FieldBase):
+    __slots__ = ('length_size',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -141,71 +364,101 @@ class BinaryField(FieldBase):
         return f'BinaryField<key: {self.key}, bytes: {self.bytes}>'
 
     def from_binary(self, binary):
-        return binary
+        return bytes(binary)
+
+    def get_width(self):
+        return None
+
+    def get_size_range(self):
+        return self.length_size, self.length_size + 256 ** self.length_size - 1
 
-    def split(self, binary):
-        bytes = int.from_bytes(binary[:self.length_size], 'big', signed=False)
-        return binary[self.length_size:bytes + self.length_size], binary[bytes + self.length_size:]
+    def size_of(self, data):
+        return self.length_size + len(data.get(self.key, self.default))
+
+    def split(self, binary, offset):
+        start = offset + self.length_size
+        end = start + int.from_bytes(binary[offset:start], 'big', signed=False)
+        return binary[start:end], end
 
     def to_binary(self, val):
         return len(val).to_bytes(self.length_size, 'big') + val
 
 
 class BitsField(FieldBase):
+    """
+    List of bools packed in bytes, the first one is the most significant bit. With output 'int' the bits are
+    decoded as an integer and with 'bitset' as a Bitset over the bytes of the message, both are also encoded.
+    """
+    __slots__ = ('length', 'output')
     length: int
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.length = js.get('length', 0)
         self.bytes = math.ceil(self.length / 8)
+        self.output = js.get('output', 'list')
+        if self.output not in BITS_OUTPUTS:
+            raise ValueError(f'BitsField<{self.key}> output must be one of {BITS_OUTPUTS}')
+        if self.output == 'int' and not self.length:
+            raise ValueError(f'BitsField<{self.key}> needs to have length declared to be decoded as int')
 
     def __repr__(self):
         return f'BitsField<key: {self.key}, length: {self.length}, bytes: {self.bytes}>'
 
-    def decode(self, binary):
-        self.ensure_length(binary)
-        a, b, length = self.split(binary)
-        val = self.from_binary_bits(a, length)
-        return val, b
+    def decode(self, binary, offset=0):
+        self.ensure_length(binary, offset)
+        a, offset, length = self.split(binary, offset)
+        if len(a) * 8 < length:
+            raise DecodeError(f'Binary has not enough data for {self}')
+        if self.output == 'int':
+            val = int.from_bytes(a, 'big', signed=False) >> (-length % 8)
+        elif self.output == 'bitset':
+            val = Bitset(a, length)
+        else:
+            val = unpack_bits(a, length)
+        return val, offset
 
-    def split(self, binary):
+    def get_size_range(self):
         if self.length:
-            return binary[:self.bytes], binary[self.bytes:], self.length
-        length = binary[0]
-        bts = math.ceil(length / 8)
-        return binary[1:bts + 1], binary[bts + 1:], length
+            return self.bytes, self.bytes
+        return 1, 1 + math.ceil(255 / 8)
 
-    def to_binary(self, val: List[bool]):
+    def size_of(self, data):
+        val = data.get(self.key, self.default)
+        if isinstance(val, int):
+            return self.bytes
+        if len(val) == 0:
+            return 1
+        return math.ceil(len(val) / 8) + (0 if self.length else 1)
+
+    def split(self, binary, offset):
+        if self.length:
+            end = offset + self.bytes
+            return binary[offset:end], end, self.length
+        length = binary[offset]
+        end = offset + 1 + math.ceil(length / 8)
+        return binary[offset + 1:end], end, length
+
+    def to_binary(self, val: Union[List[bool], Bitset, int]):
+        if isinstance(val, int):
+            if not self.length:
+                raise ValueError(f'BitsField<{self.key}> needs to have length declared to encode an int')
+            if not 0 <= val < 1 << self.length:
+                raise ValueError(f'BitsField<{self.key}> value {val} does not fit in {self.length} bits')
+            return (val << (-self.length % 8)).to_bytes(self.bytes, 'big', signed=False)
         if len(val) == 0:
             return b'\x00'
-        binary = b''
-        if len(val) % 8:
-            final = '0' * (8 - (len(val) % 8))
-        else:
-            final = ''
-        bits = ''
-        for b in val:
-            bits += '1' if b else '0'
-        bits += final
-        bts = int(len(bits) / 8)
+        binary = val.to_bytes() if isinstance(val, Bitset) else pack_bits(val)
         if not self.length:
-            binary += len(val).to_bytes(1, 'big', signed=False)
-        binary += int(bits, 2).to_bytes(bts, 'big', signed=False)
+            binary = len(val).to_bytes(1, 'big', signed=False) + binary
         return binary
 
     def from_binary_bits(self, binary, length):
-        numero = int.from_bytes(binary, 'big', signed=False)
-        bits = bin(numero)[2:]
-        max_length = (length // 8) * 8 + (8 if (length % 8) else 0)
-        if len(bits) < max_length:
-            bits = '0' * (max_length - len(bits)) + bits
-        val = []
-        for i in range(length):
-            val.append(bits[i] == '1')
-        return val
+        return unpack_bits(binary, length)
 
 
 class BoolField(FieldBase):
+    __slots__ = ()
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -214,16 +467,22 @@ class BoolField(FieldBase):
     def __repr__(self):
         return f'BoolField<key: {self.key}>'
 
+    def get_struct_code(self):
+        return 'B'
+
     def to_binary(self, val):
-        if val is None:
-            val = 2
-        else:
-            val = bool(val)
+        return self.to_struct(val).to_bytes(1, 'big', signed=False)
 
-        return val.to_bytes(1, 'big', signed=False)
+    def to_struct(self, val):
+        if val is None:
+            return 2
+        return int(bool(val))
 
     def from_binary(self, binary):
-        val = int.from_bytes(binary, 'big', signed=False)
+        return self.from_struct(int.from_bytes(binary, 'big', signed=False))
+
+    @staticmethod
+    def from_struct(val):
         if val == 0:
             return False
         elif val == 1:
@@ -233,6 +492,7 @@ class BoolField(FieldBase):
 
 
 class CharField(FieldBase):
+    __slots__ = ()
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -257,18 +517,29 @@ class CharField(FieldBase):
         val = int.from_bytes(binary[:self.bytes], 'big', signed=False)
         if val == 0:
             return None
-        return binary[:self.bytes].decode('utf')
+        return str(binary[:self.bytes], 'utf')
 
 
 class DateField(FieldBase):
+    """Day, month and year since 2000 in BCD, with cache the dates are shared by the messages"""
+    __slots__ = ('cache',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.bytes = 3
+        self.cache = js.get('cache', False)
 
     def __repr__(self):
         return f'DateField<key: {self.key}>'
 
+    def decode(self, binary, offset=0):
+        self.ensure_length(binary, offset)
+        build = cached_bcd_date if self.cache else bcd_date
+        return build(binary[offset], binary[offset + 1], binary[offset + 2]), offset + 3
+
+    def from_binary(self, binary):
+        return self.decode(binary)[0]
+
     # removed for python 3.8
     # def to_binary(self, val: datetime.datetime | str):
     def to_binary(self, val):
@@ -277,29 +548,32 @@ class DateField(FieldBase):
         elif isinstance(val, str):
             val = datetime.datetime.strptime(val, '%Y-%m-%d').date()
         return bytes([
-            self.to_nible(val.day),
-            self.to_nible(val.month),
-            self.to_nible(val.year - 2000)
+            BCD_ENCODE[val.day],
+            BCD_ENCODE[val.month],
+            to_bcd(val.year - 2000)
         ])
 
-    def from_binary(self, binary):
-        d, binary = self.get_nible(binary)
-        m, binary = self.get_nible(binary)
-        y, binary = self.get_nible(binary)
-        if y == 0 and m == 0 and d == 0:
-            return None
-        return datetime.datetime(2000 + y, m, d).date()
-
 
 class DateTimeField(FieldBase):
+    """Day, month, year since 2000, hour, minute and second in BCD"""
+    __slots__ = ('cache',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.bytes = 6
+        self.cache = js.get('cache', False)
 
     def __repr__(self):
         return f'DateTimeField<key: {self.key}>'
 
+    def decode(self, binary, offset=0):
+        self.ensure_length(binary, offset)
+        build = cached_bcd_datetime if self.cache else bcd_datetime
+        return build(*binary[offset:offset + 6]), offset + 6
+
+    def from_binary(self, binary):
+        return self.decode(binary)[0]
+
     # removed for python 3.8
     # def to_binary(self, val: datetime.datetime | str):
     def to_binary(self, val):
@@ -307,67 +581,64 @@ class DateTimeField(FieldBase):
             return bytes([0] * 6)
         elif not isinstance(val, datetime.datetime):
             raise ValueError(f'Error in field DateTimeField<{self.key}>, a datetime is expected but "{val}" is received')
-        elif isinstance(val, str):
-            val = datetime.datetime.strptime(val, '%Y-%m-%d %H:%M:%S').date()
         return bytes([
-            self.to_nible(val.day),
-            self.to_nible(val.month),
-            self.to_nible(val.year - 2000),
-            self.to_nible(val.hour),
-            self.to_nible(val.minute),
-            self.to_nible(val.second)
+            BCD_ENCODE[val.day],
+            BCD_ENCODE[val.month],
+            to_bcd(val.year - 2000),
+            BCD_ENCODE[val.hour],
+            BCD_ENCODE[val.minute],
+            BCD_ENCODE[val.second]
         ])
 
-    def from_binary(self, binary):
-        d, binary = self.get_nible(binary)
-        m, binary = self.get_nible(binary)
-        y, binary = self.get_nible(binary)
-        H, binary = self.get_nible(binary)
-        M, binary = self.get_nible(binary)
-        S, binary = self.get_nible(binary)
-        if y == 0 and m == 0 and d == 0 and H == 0 and M == 0 and S == 0:
-            return None
-        return datetime.datetime(2000 + y, m, d, H, M, S)
-
 
 class FlagsField(FieldBase):
+    """Bools of several keys packed in bytes, the last key is the least significant bit"""
+    __slots__ = ('length', 'tables')
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.keys = self.key.split(',')
         self.length = len(self.keys)
         self.bytes = math.ceil(self.length / 8)
+        # for every byte of the field, the flags of its keys for each of the 256 values
+        self.tables = []
+        pad = self.bytes * 8 - self.length
+        for i in range(self.bytes):
+            start = max(pad - i * 8, 0)
+            keys = self.keys[max(i * 8 - pad, 0):i * 8 + 8 - pad]
+            self.tables.append([dict(zip(keys, bits[start:])) for bits in BYTE_BITS])
 
     def __repr__(self):
         return f'FlagsField<keys: {self.keys}, length: {self.length}, bytes: {self.bytes}>'
 
+    def decode_into(self, binary, offset, data):
+        self.ensure_length(binary, offset)
+        for table in self.tables:
+            data.update(table[binary[offset]])
+            offset += 1
+        return offset
+
     def encode(self, data):
         return self.to_binary(data)
 
     def from_binary(self, binary):
-        numero = int.from_bytes(binary[:self.bytes], 'big', signed=False)
-        bits = bin(numero)[2:]
-        flags = [False] * 8
-        for b in bits:
-            flags.append(b == '1')
         val = {}
-        order = -len(self.keys)
-        for k in self.keys:
-            val[k] = flags[order]
-            order += 1
+        for table, byte in zip(self.tables, binary):
+            val.update(table[byte])
         return val
 
     def to_binary(self, data, allow_none=False):
-        bits = '0' * (8 - (len(self.keys) % 8))
+        number = 0
         for k in self.keys:
             val = data.get(k)
             if val is None:
                 raise ValueError(f'Error in field FlagsField<{self.key}>, a boolean is expected but "None" is received')
-            bits += '1' if data[k] else '0'
-        return int(bits, 2).to_bytes(self.bytes, 'big', signed=False)
+            number = number << 1 | (1 if val else 0)
+        return number.to_bytes(self.bytes, 'big', signed=False)
 
 
 class FloatField(FieldBase):
+    __slots__ = ('decimals', 'scale')
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -376,57 +647,103 @@ class FloatField(FieldBase):
             raise ValueError(f'FloatField<{self.key}> needs to have bytes declared')
         if self.decimals == None:
             raise ValueError(f'FloatField<{self.key}> needs to have decimals declared')
+        self.scale = 10 ** self.decimals
 
     def __repr__(self):
         return f'FloatField<key: {self.key}, bytes: {self.bytes}, decimals: {self.decimals}>'
 
+    def get_struct_code(self):
+        return SIGNED_CODES.get(self.bytes)
+
+    def get_array_typecode(self):
+        return 'd'
+
+    def from_vector(self, column):
+        return column / self.scale
+
     def from_binary(self, binary):
-        val = int.from_bytes(binary[:self.bytes], 'big', signed=True)
-        return val / (10 ** self.decimals)
+        return int.from_bytes(binary[:self.bytes], 'big', signed=True) / self.scale
+
+    def from_struct(self, val):
+        return val / self.scale
 
     def to_binary(self, val):
-        return int(round(val * (10 ** self.decimals))).to_bytes(self.bytes, 'big', signed=True)
+        return self.to_struct(val).to_bytes(self.bytes, 'big', signed=True)
+
+    def to_struct(self, val):
+        return int(round(val * self.scale))
 
 
 class IdField(FieldBase):
+    __slots__ = ('max_value',)
+
+    def __init__(self, k, js):
+        super().__init__(k, js)
+        self.max_value = 256 ** self.bytes - 1 if self.bytes is not None else None
 
     def __repr__(self):
         return f'IdField<key: {self.key}, bytes: {self.bytes}>'
 
+    def get_struct_code(self):
+        return UNSIGNED_CODES.get(self.bytes)
+
     def to_binary(self, val):
+        return self.to_struct(val).to_bytes(self.bytes, 'big', signed=False)
+
+    def to_struct(self, val):
         if val is None:
             val = 0
-        max_value = 256 ** self.bytes - 1
-        val = min(val, max_value)
+        val = min(val, self.max_value)
         if val < 0:
             raise ValueError('IdField<{self.key}> does not allow negative values')
-        return int(val).to_bytes(self.bytes, 'big', signed=False)
+        return int(val)
 
     def from_binary(self, binary):
-        val = int.from_bytes(binary[:self.bytes], 'big', signed=False)
+        return self.from_struct(int.from_bytes(binary[:self.bytes], 'big', signed=False))
+
+    @staticmethod
+    def from_struct(val):
         if val == 0:
             val = None
         return val
 
 
 class SignedField(FieldBase):
+    __slots__ = ('max_value', 'min_value')
+
+    def __init__(self, k, js):
+        super().__init__(k, js)
+        if self.bytes is not None:
+            self.max_value = 256 ** self.bytes / 2 - 1
+            self.min_value = - self.max_value - 1
 
     def __repr__(self):
         return f'SignedField<key: {self.key}, bytes: {self.bytes}>'
 
+    def get_struct_code(self):
+        return SIGNED_CODES.get(self.bytes)
+
+    def get_array_typecode(self):
+        return integer_typecode(self.bytes, signed=True)
+
+    def from_vector(self, column):
+        return native(column)
+
     def to_binary(self, val):
+        return self.to_struct(val).to_bytes(self.bytes, 'big', signed=True)
+
+    def to_struct(self, val):
         if val is None:
             val = 0
-        maximo = 256 ** self.bytes / 2 - 1
-        minimo = - maximo - 1
-        val = max(min(val, maximo), minimo)
-        return int(val).to_bytes(self.bytes, 'big', signed=True)
+        val = max(min(val, self.max_value), self.min_value)
+        return int(val)
 
     def from_binary(self, binary):
         return int.from_bytes(binary, 'big', signed=True)
 
 
 class StringField(FieldBase):
+    __slots__ = ('length_size',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
@@ -437,15 +754,31 @@ class StringField(FieldBase):
 
     def from_binary(self, binary):
         try:
-            return binary.decode('utf')
+            return str(binary, 'utf')
         except UnicodeEncodeError:
             raise DecodeError(f"{self}: Can't decode string: {binary}")
 
-    def split(self, binary):
+    def get_size_range(self):
+        if self.bytes:
+            return self.bytes, self.bytes
+        return self.length_size, self.length_size + 256 ** self.length_size - 1
+
+    def size_of(self, data):
+        val = data.get(self.key, self.default)
+        if self.bytes:
+            # a shorter string is not padded
+            return len(str(val).encode('utf')[:self.bytes])
+        if val is None:
+            return self.length_size
+        return self.length_size + len(str(val).encode('utf')[:255])
+
+    def split(self, binary, offset):
         if self.bytes:
-            return binary[:self.bytes], binary[self.bytes:]
-        bytes = int.from_bytes(binary[:self.length_size], 'big', signed=False)
-        return binary[self.length_size:bytes + self.length_size], binary[bytes + self.length_size:]
+            end = offset + self.bytes
+            return binary[offset:end], end
+        start = offset + self.length_size
+        end = start + int.from_bytes(binary[offset:start], 'big', signed=False)
+        return binary[start:end], end
 
     def to_binary(self, val):
         if self.bytes:
@@ -459,19 +792,36 @@ class StringField(FieldBase):
 
 
 class TimeField(FieldBase):
+    """Hour and minute in BCD, packed in StructBlocks as an unsigned short"""
+    __slots__ = ('cache',)
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.bytes = 2
+        self.cache = js.get('cache', False)
 
     def __repr__(self):
         return f'TimeField<key: {self.key}, bytes: {self.bytes}>'
 
+    def get_struct_code(self):
+        return 'H'
+
+    def from_binary(self, binary):
+        return self.from_struct(binary[0] << 8 | binary[1])
+
+    def from_struct(self, val):
+        if self.cache:
+            return cached_bcd_time(val >> 8, val & 0xff)
+        return bcd_time(val >> 8, val & 0xff)
+
     # removed for python 3.8
     # def to_binary(self, val: datetime.datetime | datetime.time | str):
     def to_binary(self, val):
+        return self.to_struct(val).to_bytes(2, 'big', signed=False)
+
+    def to_struct(self, val):
         if val is None:
-            return bytes([0] * 2)
+            return 0
         elif isinstance(val, str):
             try:
                 if len(val) > 5:
@@ -484,61 +834,137 @@ class TimeField(FieldBase):
         elif not isinstance(val, datetime.datetime) and not isinstance(val, datetime.time):
             raise ValueError(f'Error in field TimeField<{self.key}>, a datetime or time is expected but "{val}" is received')
 
-        return bytes([
-            self.to_nible(val.hour),
-            self.to_nible(val.minute)
-        ])
-
-    def from_binary(self, binary):
-        H, binary = self.get_nible(binary)
-        M, binary = self.get_nible(binary)
-        if H == 0 and M == 0:
-            return None
-        return datetime.time(H, M)
+        return BCD_ENCODE[val.hour] << 8 | BCD_ENCODE[val.minute]
 
 
 class TimestampField(FieldBase):
+    """
+    Time since the epoch in units of 10 ** -decimals seconds. tz 'local' decodes naive local datetimes,
+    'naive' naive UTC datetimes, and 'utc' or a zone name like 'America/Lima' aware datetimes.
+    Output 'int' keeps the raw integer, 0 included, without building datetimes.
+    """
+    __slots__ = ('decimals', 'scale', 'tz', 'zone', 'output', 'micro_div')
 
     def __init__(self, k, js):
         super().__init__(k, js)
         self.bytes = js.get('bytes', 6)
         self.decimals = js.get('decimals', 6)
+        self.scale = 10 ** self.decimals
+        # units of the value in a microsecond, above 1 the value is truncated to microseconds
+        self.micro_div = 10 ** max(self.decimals - 6, 0)
+        self.tz = js.get('tz', 'local')
+        self.zone = None
+        if self.tz == 'utc':
+            self.zone = datetime.timezone.utc
+        elif self.tz not in ('local', 'naive'):
+            try:
+                from zoneinfo import ZoneInfo
+            except ImportError:
+                # python 3.8, zoneinfo is in the backports.zoneinfo package
+                try:
+                    from backports.zoneinfo import ZoneInfo
+                except ImportError:
+                    raise ValueError(f'TimestampField<{self.key}> needs python 3.9 or backports.zoneinfo for tz {self.tz}')
+            try:
+                self.zone = ZoneInfo(self.tz)
+            except (ValueError, LookupError):
+                raise ValueError(f'TimestampField<{self.key}> has an unknown tz {self.tz}')
+        self.output = js.get('output', 'datetime')
+        if self.output not in TIMESTAMP_OUTPUTS:
+            raise ValueError(f'TimestampField<{self.key}> output must be one of {TIMESTAMP_OUTPUTS}')
 
     def __repr__(self):
         return f'TimestampField<key: {self.key}>'
 
+    def get_struct_code(self):
+        return UNSIGNED_CODES.get(self.bytes)
+
+    def get_array_typecode(self):
+        if self.output == 'int':
+            return integer_typecode(self.bytes, signed=False)
+        return None
+
+    def from_vector(self, column):
+        if self.output == 'int':
+            return native(column)
+        return super().from_vector(column)
+
     # removed for python 3.8
-    # def to_binary(self, val: datetime.datetime | str):
+    # def to_binary(self, val: datetime.datetime | int):
     def to_binary(self, val):
+        return self.to_struct(val).to_bytes(self.bytes, 'big', signed=False)
+
+    def to_struct(self, val):
         if val is None:
-            return bytes([0] * 8)
-        timestamp = val.timestamp() * (10 ** self.decimals)
-        return int(timestamp).to_bytes(self.bytes, 'big', signed=False)
+            return 0
+        if isinstance(val, int):
+            return val
+        if not isinstance(val, datetime.datetime):
+            raise ValueError(f'Error in field TimestampField<{self.key}>, a datetime is expected but "{val}" is received')
+        if val.tzinfo is None and self.tz == 'local':
+            # the whole seconds of the float are exact, the microseconds are taken from the datetime
+            micro = int(val.timestamp()) * 1000000 + val.microsecond
+        else:
+            if val.tzinfo is None and self.zone is not None and self.zone is not datetime.timezone.utc:
+                delta = val.replace(tzinfo=self.zone) - EPOCH_UTC
+            elif val.tzinfo is None:
+                delta = val - EPOCH
+            else:
+                delta = val - EPOCH_UTC
+            micro = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        if self.decimals <= 6:
+            return micro // (1000000 // self.scale)
+        return micro * self.micro_div
 
     def from_binary(self, binary):
-        d = int.from_bytes(binary, 'big')
-        if d == 0:
+        return self.from_struct(int.from_bytes(binary, 'big'))
+
+    def from_struct(self, val):
+        if self.output == 'int':
+            return val
+        if val == 0:
             return None
-        return datetime.datetime.fromtimestamp(d / (10 ** self.decimals))
+        if self.tz == 'naive':
+            seconds, fraction = divmod(val, self.scale)
+            return EPOCH + datetime.timedelta(0, seconds, fraction * 1000000 // self.scale if self.decimals <= 6
+                                              else fraction // self.micro_div)
+        if self.micro_div == 1:
+            # rounded to microseconds by fromtimestamp, the float keeps them exact until the year 2242
+            return datetime.datetime.fromtimestamp(val / self.scale, self.zone)
+        seconds, fraction = divmod(val, self.scale)
+        return datetime.datetime.fromtimestamp(seconds, self.zone).replace(microsecond=fraction // self.micro_div)
 
 
 class UnsignedField(FieldBase):
+    __slots__ = ('max_value',)
+    default = 0
+
+    def __init__(self, k, js):
+        super().__init__(k, js)
+        self.max_value = 256 ** self.bytes - 1 if self.bytes is not None else None
 
     def __repr__(self):
         return f'UnsignedField<key: {self.key}, bytes: {self.bytes}>'
 
-    def encode(self, data):
-        val = data.get(self.key, 0)
-        return self.to_binary(val)
+    def get_struct_code(self):
+        return UNSIGNED_CODES.get(self.bytes)
+
+    def get_array_typecode(self):
+        return integer_typecode(self.bytes, signed=False)
+
+    def from_vector(self, column):
+        return native(column)
 
     def to_binary(self, val):
+        return self.to_struct(val).to_bytes(self.bytes, 'big', signed=False)
+
+    def to_struct(self, val):
         if val is None:
             raise ValueError(f'Error in field UnsignedField<{self.key}>, None is not allowed')
-        max_value = 256 ** self.bytes - 1
-        val = min(val, max_value)
+        val = min(val, self.max_value)
         if val < 0:
             raise ValueError(f'Error in field UnsignedField<{self.key}>, positive integers expected but "{val}" is received')
-        return int(val).to_bytes(self.bytes, 'big', signed=False)
+        return int(val)
 
     def from_binary(self, binary):
         return int.from_bytes(binary[:self.bytes], 'big', signed=False)
@@ -0,0 +1,80 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+
+# protocol of the worker process, built once by init_worker
+_protocol = None
+
+
+def protocol_source(protocol):
+    """Returns the arguments that build the protocol again in a worker, the file when it was loaded from one"""
+    source = {'server': protocol.server, 'crc_backend': protocol.crc_backend, 'backend': protocol.backend,
+              'cache_dir': protocol.cache_dir}
+    if protocol.file:
+        source.update(file=os.path.abspath(protocol.file), cache=True)
+    else:
+        source['js'] = protocol.definition
+    return source
+
+
+def init_worker(source):
+    global _protocol
+    from protobin.protocol import Protocol
+    _protocol = Protocol(**source)
+
+
+def decode_chunk(frames, codec, columnar):
+    return _protocol.decode_many(frames, codec, columnar)
+
+
+class ParallelDecoder:
+    """
+    Decodes frames in a pool of processes, every worker builds the protocol once from its file
+    (or its compiled form) and receives the frames in chunks of chunksize.
+    It is a context manager, the pool is kept between calls to decode until it is closed.
+    """
+
+    def __init__(self, protocol, workers=None, chunksize=256, mp_context=None):
+        self.chunksize = chunksize
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=mp_context, initializer=init_worker, initargs=(protocol_source(protocol),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def decode(self, frames, codec=None, columnar=False):
+        """
+        Yields the result of decode for each frame in the same order. Only two chunks per worker are pending,
+        so frames can be a generator larger than the memory. The first error of a frame is raised.
+        """
+        pending = collections.deque()
+        chunks = self.chunks(frames)
+        try:
+            for chunk in itertools.islice(chunks, self.workers * 2):
+                pending.append(self.executor.submit(decode_chunk, chunk, codec, columnar))
+            while pending:
+                results = pending.popleft().result()
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(self.executor.submit(decode_chunk, chunk, codec, columnar))
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def chunks(self, frames):
+        frames = iter(frames)
+        while True:
+            # memoryviews are not picklable
+            chunk = [bytes(binary) if isinstance(binary, memoryview) else binary
+                     for binary in itertools.islice(frames, self.chunksize)]
+            if not chunk:
+                return
+            yield chunk
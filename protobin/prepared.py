@@ -0,0 +1,129 @@
+from protobin.compiler import StructBlock
+from protobin.errors import InputError
+
+
+def plan_parts(plan):
+    """
+    Returns the part of the encoded plan of every key: the index of its item, its offset inside the item,
+    the field that encodes it and its width. The fields of a StructBlock are parts of the block, the other
+    items have width None and are replaced as a whole.
+    """
+    parts = {}
+    for i, f in enumerate(plan):
+        if isinstance(f, StructBlock):
+            sub = 0
+            for field in f.fields:
+                parts[field.key] = (i, sub, field, field.get_width())
+                sub += field.get_width()
+            continue
+        for k in f.keys or [f.key]:
+            # a fixed string shorter than its bytes is not padded, the item is replaced as a whole
+            parts[k] = (i, 0, f, None)
+    return parts
+
+
+class PreparedMessage:
+    """
+    Message encoded once and patched by update, for the messages that are sent again and again with a few
+    changed fields. Only the fields of the changed keys are encoded again: fixed-width ones are written over
+    their bytes and variable-length ones are spliced when their size changes.
+    Made by Protocol.prepare the frame has length and CRC, and the CRC is continued from the value it had
+    before the first changed field instead of computed over the whole payload. It is not thread-safe,
+    use one per connection.
+    """
+
+    def __init__(self, format, data, protocol=None):
+        self.format = format
+        self.protocol = protocol
+        self.data = dict(data.items())
+        self.plan = format.output_plan
+        self.buffer = bytearray(format.prefix)
+        # start of every item of the plan and the end of the message
+        self.offsets = []
+        for f in self.plan:
+            self.offsets.append(len(self.buffer))
+            f.encode_into(self.buffer, self.data)
+        self.offsets.append(len(self.buffer))
+        self.engine = None
+        if protocol is not None and protocol.crc16 and (protocol.fake_prefix and format.header or format.crc):
+            self.engine = protocol.crc16
+            self.crc_size = protocol.crc_size if format.crc_size is None else format.crc_size
+        # CRC of the bytes before every item, None when it is not known or it is out of date
+        self.checkpoints = [None] * len(self.offsets)
+        # first item changed since the CRC was computed, None when the CRC is up to date
+        self.dirty = 0
+        self.crc_value = None
+
+    def __repr__(self):
+        return f'PreparedMessage<format: {self.format.name}, bytes: {len(self.buffer)}>'
+
+    def __bytes__(self):
+        return bytes(self.buffer)
+
+    def update(self, changes=None, **kwargs):
+        """
+        Changes the values of some keys, update({'datero_bus_-1': 12}) or update(delay=-30).
+        The fields are encoded before anything is changed, so a value that can not be encoded leaves the
+        message as it was.
+        """
+        changes = dict(changes or {}, **kwargs)
+        parts = self.format.output_parts
+        changed = {}
+        for k in changes:
+            if k not in parts:
+                raise InputError(f'{k} is not a field of {self.format.name}')
+            # the keys of a flags field are one part
+            changed[parts[k][:2]] = parts[k]
+        data = dict(self.data, **changes)
+        encoded = [(changed[part], changed[part][2].encode(data)) for part in sorted(changed)]
+        self.data = data
+        for (i, sub, f, width), binary in encoded:
+            start = self.offsets[i] + sub
+            end = self.offsets[i + 1] if width is None else start + width
+            if self.buffer[start:end] == binary:
+                continue
+            self.buffer[start:end] = binary
+            moved = len(binary) - (end - start)
+            if moved:
+                # the items after a variable-length one that changed its size
+                for j in range(i + 1, len(self.offsets)):
+                    self.offsets[j] += moved
+            self.changed(i)
+        return self
+
+    def changed(self, i):
+        if self.dirty is None or i < self.dirty:
+            self.dirty = i
+        for j in range(i + 1, len(self.checkpoints)):
+            self.checkpoints[j] = None
+        self.crc_value = None
+
+    def crc(self):
+        """Returns the CRC of the message, continued from the last known value before the first changed item"""
+        if self.crc_value is None:
+            engine = self.engine
+            offsets = self.offsets
+            i = self.dirty
+            with memoryview(self.buffer) as view:
+                if self.checkpoints[0] is None:
+                    self.checkpoints[0] = engine(view[:offsets[0]])
+                j = i
+                while self.checkpoints[j] is None:
+                    j -= 1
+                value = self.checkpoints[j]
+                if j < i:
+                    value = self.checkpoints[i] = engine(view[offsets[j]:offsets[i]], value)
+                self.crc_value = engine(view[offsets[i]:], value)
+            self.dirty = None
+        return self.crc_value
+
+    def encode(self):
+        """Returns the message, the same bytes encode of the format or the protocol produces for its data"""
+        payload = bytes(self.buffer)
+        protocol = self.protocol
+        if self.engine is None:
+            return payload
+        crc = self.crc().to_bytes(self.crc_size, byteorder=protocol.crc_byteorder)
+        if protocol.fake_prefix and self.format.header:
+            return payload + crc
+        return len(payload).to_bytes(protocol.length, 'big', signed=False) + payload + crc
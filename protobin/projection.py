@@ -0,0 +1,149 @@
+from protobin.compiler import StructBlock
+from protobin.errors import InputError
+from protobin.fields import ArrayField
+
+
+class SkipBytes:
+    """Run of fixed-width fields that are not requested, they are skipped by their total size"""
+
+    def __init__(self, bytes):
+        self.bytes = bytes
+
+    def __repr__(self):
+        return f'SkipBytes<bytes: {self.bytes}>'
+
+    def decode_into(self, binary, offset, data):
+        return offset + self.bytes
+
+
+class SkipField:
+    """Variable-length field that is not requested, only its length is read"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __repr__(self):
+        return f'SkipField<key: {self.field.key}>'
+
+    def decode_into(self, binary, offset, data):
+        return self.field.skip(binary, offset)
+
+
+class BlockProjection:
+    """StructBlock with some requested fields, it is unpacked at once and only those keys are kept"""
+
+    def __init__(self, block, keys):
+        self.block = block
+        self.keys = keys
+        self.converters = [(i, k, conv) for i, (k, conv) in enumerate(block.converters) if k in keys]
+
+    def __repr__(self):
+        return f'BlockProjection<keys: {self.keys}>'
+
+    def decode_into(self, binary, offset, data):
+        block = self.block
+        if len(binary) - offset < block.bytes:
+            # the fields raise their DecodeError
+            return block.decode_into(binary, offset, {})
+        values = block.struct.unpack_from(binary, offset)
+        for i, k, conv in self.converters:
+            data[k] = conv(values[i]) if conv else values[i]
+        return offset + block.bytes
+
+
+class KeysProjection:
+    """Field of several keys, like flags, with some of them requested"""
+
+    def __init__(self, field, keys):
+        self.field = field
+        self.keys = keys
+
+    def decode_into(self, binary, offset, data):
+        val, offset = self.field.decode(binary, offset)
+        for k in self.keys:
+            data[k] = val[k]
+        return offset
+
+
+class ArrayProjection:
+    """Array with some fields of its elements requested"""
+
+    def __init__(self, field, plan):
+        self.field = field
+        self.key = field.key
+        self.plan = plan
+
+    def __repr__(self):
+        return f'ArrayProjection<key: {self.key}, plan: {self.plan}>'
+
+    def decode_into(self, binary, offset, data):
+        length = binary[offset]
+        offset += 1
+        lista = []
+        for i in range(length):
+            item = {}
+            for f in self.plan:
+                offset = f.decode_into(binary, offset, item)
+            lista.append(item)
+        data[self.key] = lista
+        return offset
+
+
+def parse_fields(fields):
+    """
+    Converts the dotted paths of the requested fields to a tree of dicts, None requests the whole field.
+    ['positions.lat', 'positions.lng', '#reports'] is {'positions': {'lat': None, 'lng': None}, '#reports': None}
+    """
+    tree = {}
+    for path in fields:
+        *parents, leaf = path.split('.')
+        node = tree
+        for k in parents:
+            if k in node and node[k] is None:
+                # the whole field was already requested
+                break
+            node = node.setdefault(k, {})
+        else:
+            node[leaf] = None
+    return tree
+
+
+def project_plan(plan, tree, path=''):
+    """
+    Returns the plan that decodes only the fields of the tree. The other fixed-width fields are merged in
+    SkipBytes and the variable-length ones only read their length.
+    """
+    projected = []
+    found = set()
+    skipped = 0
+    for f in plan:
+        keys = f.keys or [f.key]
+        requested = [k for k in keys if k in tree]
+        found.update(requested)
+        if not requested:
+            width = f.get_width()
+            if width is not None:
+                skipped += width
+                continue
+            step = SkipField(f)
+        elif isinstance(f, StructBlock) and len(requested) < len(keys):
+            step = BlockProjection(f, requested)
+        elif isinstance(f, ArrayField) and tree[f.key] is not None:
+            step = ArrayProjection(f, project_plan(f.plan, tree[f.key], f'{path}{f.key}.'))
+        elif f.keys and len(requested) < len(keys):
+            step = KeysProjection(f, requested)
+        else:
+            step = f
+        if skipped:
+            projected.append(SkipBytes(skipped))
+            skipped = 0
+        projected.append(step)
+    if skipped:
+        projected.append(SkipBytes(skipped))
+    arrays = {f.key for f in plan if isinstance(f, ArrayField)}
+    for k, subtree in tree.items():
+        if k not in found:
+            raise InputError(f'{path}{k} is not a field')
+        if subtree is not None and k not in arrays:
+            raise InputError(f'{path}{k} is not an array')
+    return projected
@@ -1,15 +1,45 @@
 import json
-import yaml
-import crcmod
 
-from protobin.errors import InputError, FormatError, CRCError
+from protobin import codegen
+from protobin.cache import load_compiled, save_compiled
+from protobin.compiler import compile_fields
+from protobin.crc import make_crc
+from protobin.errors import InputError, FormatError, CRCError, DecodeError
 from protobin.fields import FieldBase, FIELD_MAP
+from protobin.parallel import ParallelDecoder
+from protobin.prepared import PreparedMessage, plan_parts
+from protobin.projection import parse_fields, project_plan
+from protobin.records import RecordType
+from protobin.stream import StreamDecoder
+from protobin.view import RecordView
+
+
+EQUAL = ord('=')
+
+
+def load_yaml(text):
+    # yaml is only imported by the protocols defined in yaml files, with its C loader when it is compiled
+    import yaml
+    return yaml.load(text, Loader=getattr(yaml, 'CFullLoader', yaml.FullLoader))
+
+
+def plan_size_range(plan):
+    """Returns the minimum and maximum number of bytes of a plan, the maximum is None when it is unbounded"""
+    minimum = maximum = 0
+    for f in plan:
+        low, top = f.get_size_range()
+        minimum += low
+        maximum = None if maximum is None or top is None else maximum + top
+    return minimum, maximum
 
 
 class Format:
 
     input_fields: [FieldBase]
     output_fields: [FieldBase]
+    # functions generated by the codegen backend, None uses the plans
+    decode_function = None
+    encode_function = None
 
     def __init__(self, name: str, format, server: bool):
         self.name = name
@@ -19,6 +49,14 @@ class Format:
         self.codec = format.get('codec')
         self.crc = format.get('crc', True)
         self.crc_size = format.get('crc_size')
+        if self.header:
+            self.prefix = self.header.encode('utf') + b'='
+        elif self.codec:
+            # added for python 3.8
+            # self.prefix = self.codec.to_bytes()
+            self.prefix = self.codec.to_bytes(1, 'big')
+        else:
+            self.prefix = b''
         if server is None:
             input_mode = 'fields'
             output_mode = 'fields'
@@ -33,6 +71,10 @@ class Format:
             self.input_fields.append(FIELD_MAP[f['type']](k, f))
         for k, f in format[output_mode].items():
             self.output_fields.append(FIELD_MAP[f['type']](k, f))
+        self.input_plan = self.input_fields
+        self.output_plan = self.output_fields
+        self.projections = {}
+        self.record_types = {}
 
     def __repr__(self):
         if self.header:
@@ -40,29 +82,101 @@ class Format:
         elif self.codec:
             return f'Format: {self.name} <{self.codec}>'
 
+    def __getstate__(self):
+        # generated functions and record classes are not picklable, they are generated again
+        state = self.__dict__.copy()
+        state.pop('decode_function', None)
+        state.pop('encode_function', None)
+        state['record_types'] = {}
+        return state
+
+    def compile(self):
+        self.input_plan = compile_fields(self.input_fields)
+        self.output_plan = compile_fields(self.output_fields)
+        # bytes of the fields decode reads, size is None when they are not fixed
+        self.min_size, self.max_size = plan_size_range(self.input_plan)
+        self.size = self.min_size if self.min_size == self.max_size else None
+        # where every key is encoded, for the prepared messages
+        self.output_parts = plan_parts(self.output_plan)
+
+    def size_of(self, data):
+        """Returns the number of bytes encode(data) produces, the prefix included, without encoding it"""
+        return len(self.prefix) + sum(f.size_of(data) for f in self.output_plan)
+
     def encode(self, data):
-        binary = b''
-        if self.header:
-            binary += self.header.encode('utf') + b'='
-        elif self.codec:
-            # added for python 3.8
-            # binary += self.codec.to_bytes()
-            binary += self.codec.to_bytes(1, 'big')
-        for f in self.output_fields:
-            binary += f.encode(data)
-        return binary
+        buf = bytearray()
+        self.encode_into(buf, data)
+        return bytes(buf)
 
-    def decode(self, binary):
-        data = {}
-        for f in self.input_fields:
-            val, binary = f.decode(binary)
-            if f.keys:
-                for k in f.keys:
-                    data[k] = val[k]
-            else:
-                data[f.key] = val
+    def encode_into(self, buf, data):
+        """Appends the header and the fields to the bytearray buf"""
+        if self.encode_function:
+            self.encode_function(buf, data)
+            return
+        buf += self.prefix
+        for f in self.output_plan:
+            f.encode_into(buf, data)
+
+    def prepare(self, data):
+        """Returns a PreparedMessage of data, update changes some keys without encoding the whole message"""
+        return PreparedMessage(self, data)
+
+    def project(self, fields):
+        """Returns the plan that decodes only the fields, dotted paths like positions.lat, it is built once"""
+        key = tuple(fields)
+        if key not in self.projections:
+            self.projections[key] = project_plan(self.input_plan, parse_fields(fields))
+        return self.projections[key]
+
+    def record_type(self, kind='slots'):
+        """Returns the RecordType of the input fields, records are __slots__ classes or NamedTuples (tuple)"""
+        if kind not in self.record_types:
+            self.record_types[kind] = RecordType(self.name, self.input_fields, kind, self.input_plan)
+        return self.record_types[kind]
+
+    def decode(self, binary, offset=0, columnar=False, lazy=False, fields=None, records=None, lazy_cache=True):
+        data, offset = self.decode_from(binary, offset, columnar, lazy, fields, records, lazy_cache)
         return data
 
+    def decode_from(self, binary, offset=0, columnar=False, lazy=False, fields=None, records=None, lazy_cache=True):
+        """
+        Decodes the fields starting at offset, returns the data and the offset where the message ends.
+        In columnar mode the arrays are decoded as a dict of columns instead of a list of dicts.
+        In lazy mode the data is a RecordView that decodes each field when it is accessed, with lazy_cache
+        the decoded values are kept for the next access.
+        With fields only those fields are decoded and the others are skipped.
+        records, 'slots' or 'tuple', returns the data and the elements of the arrays as record classes.
+        """
+        if records is not None:
+            if lazy:
+                raise InputError('Records can not be decoded in lazy mode')
+            if columnar or fields is not None:
+                data, offset = self.decode_from(binary, offset, columnar, lazy, fields)
+                return self.record_type(records).convert(data), offset
+            return self.record_type(records).decode_from(binary, offset)
+        if fields is not None:
+            if columnar or lazy:
+                raise InputError('A projection of fields can not be decoded in columnar or lazy mode')
+            data = {}
+            for f in self.project(fields):
+                offset = f.decode_into(binary, offset, data)
+            if offset > len(binary):
+                raise DecodeError(f'Binary has not enough data for {self}')
+            return data, offset
+        if lazy:
+            view = RecordView(self.input_plan, binary, offset, lazy_cache)
+            return view, view.end
+        if self.decode_function and not columnar:
+            return self.decode_function(binary, offset)
+        data = {}
+        if columnar:
+            for f in self.input_plan:
+                offset = f.decode_columns_into(binary, offset, data)
+        else:
+            for f in self.input_plan:
+                offset = f.decode_into(binary, offset, data)
+        return data, offset
+
 
 class Protocol:
     crc16 = None
@@ -70,22 +184,50 @@ class Protocol:
     crc_size = 2
     fake_prefix = None
 
-    def __init__(self, server: bool = None, file=None, js=None):
+    def __init__(self, server: bool = None, file=None, js=None, crc_backend=None, backend=None, cache_dir=None,
+                 cache=False):
+        """
+        backend 'codegen' generates python functions for the formats instead of interpreting the fields,
+        they are cached in cache_dir, by default $PROTOBIN_CACHE or ~/.cache/protobin, False disables the cache.
+        With cache the protocol of a file is compiled once and pickled in a __protobin__ folder next to the file,
+        the next processes unpickle it until the file is modified.
+        """
+        if backend not in (None, 'codegen'):
+            raise ValueError(f'Invalid backend {backend}, these are the available backends [None, \'codegen\']')
         self.server = server
+        self.file = file
+        self.crc_backend = crc_backend
+        self.backend = backend
+        self.cache_dir = cache_dir
         self.headers = {}
         self.codecs = {}
         if file:
+            options = {'server': server, 'crc_backend': crc_backend, 'backend': backend, 'cache_dir': cache_dir}
+            compiled = load_compiled(file, options) if cache else None
+            if compiled:
+                self.__dict__.update(compiled.__dict__)
+                # the pickle keeps the path of the process that wrote it, maybe relative to other folder
+                self.file = file
+                return
             with open(file, 'r') as f:
                 if 'json' in file:
                     js = json.loads(f.read())
                     self.load_format(js)
                 elif 'yaml' in file:
-                    js = yaml.full_load(f.read())
+                    js = load_yaml(f.read())
                     self.load_format(js)
+            if cache:
+                save_compiled(file, options, self)
         else:
             self.load_format(js)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.backend == 'codegen':
+            codegen.install(self, self.cache_dir)
+
     def load_format(self, js):
+        self.definition = js
         if 'crc' in js:
             self.config_crc(js['crc'])
             self.length = js['length']
@@ -97,10 +239,20 @@ class Protocol:
             if format.get('header') in self.headers:
                 raise FormatError(f'The \"{format["header"]}\" header is already in use at \"{self.headers[format["header"]]}\"')
             self.formats[name] = Format(name=name, format=format, server=self.server)
+            self.formats[name].compile()
             if 'header' in format:
                self.headers[format['header']] = name
             if 'codec' in format:
                self.codecs[format['codec']] = name
+        self.compile_dispatch()
+        if self.backend == 'codegen':
+            codegen.install(self, self.cache_dir)
+
+    def compile_dispatch(self):
+        """Builds the lookup tables that find the format of a frame from its first bytes"""
+        self.header_dispatch = {h.encode('utf'): self.formats[name] for h, name in self.headers.items()}
+        self.header_lengths = sorted({len(h) for h in self.header_dispatch})
+        self.codec_dispatch = {codec: self.formats[name] for codec, name in self.codecs.items()}
 
     def get_format(self, h):
         return self.formats[self.headers[h.decode('utf')]]
@@ -111,72 +263,175 @@ class Protocol:
         return self.formats[self.codecs[int.from_bytes(h, 'big')]]
 
     def encode(self, data, format_key):
+        buf = bytearray()
+        self.encode_into(buf, data, format_key)
+        return bytes(buf)
+
+    def encode_into(self, buf, data, format_key, offset=None):
+        """
+        Writes the frame into buf at offset, by default it is appended at the end.
+        When buf is a bytearray and the frame is appended it is encoded in place, any other writable buffer
+        (memoryview, shared memory) receives a copy of the frame. Returns the offset where the frame ends.
+        """
         if format_key not in self.formats:
             raise InputError(f'{format_key} is not available format, these are the all availables formats {self.formats.keys()}')
         format = self.formats[format_key]
-        binary = format.encode(data)
+        if offset is None:
+            offset = len(buf)
+        if not isinstance(buf, bytearray) or offset != len(buf):
+            frame = bytearray()
+            self.write_frame(frame, data, format)
+            end = offset + len(frame)
+            buf[offset:end] = frame
+            return end
+        try:
+            self.write_frame(buf, data, format)
+        except Exception:
+            # do not leave a half written frame in the caller's buffer
+            del buf[offset:]
+            raise
+        return len(buf)
+
+    def write_frame(self, buf, data, format):
+        start = len(buf)
         if self.fake_prefix and format.header:
-            binary = binary + self.get_crc(binary, format.crc_size)
+            format.encode_into(buf, data)
+            crc = self.get_crc(memoryview(buf)[start:], format.crc_size)
+            buf += crc
         elif format.crc and self.crc16:
-            binary = len(binary).to_bytes(self.length, 'big', signed=False) + binary + self.get_crc(binary, format.crc_size)
+            # the length prefix is reserved and filled when the payload size is known
+            buf += bytes(self.length)
+            payload = len(buf)
+            format.encode_into(buf, data)
+            buf[start:payload] = (len(buf) - payload).to_bytes(self.length, 'big', signed=False)
+            crc = self.get_crc(memoryview(buf)[payload:], format.crc_size)
+            buf += crc
+        else:
+            format.encode_into(buf, data)
 
-        return binary
+    def prepare(self, data, format_key):
+        """Returns a PreparedMessage whose encode returns the frame of data, with length and crc"""
+        if format_key not in self.formats:
+            raise InputError(f'{format_key} is not available format, these are the all availables formats {self.formats.keys()}')
+        return PreparedMessage(self.formats[format_key], data, self)
+
+    def size_of(self, data, format_key):
+        """Returns the number of bytes of the frame encode(data, format_key) produces, length and crc included"""
+        if format_key not in self.formats:
+            raise InputError(f'{format_key} is not available format, these are the all availables formats {self.formats.keys()}')
+        format = self.formats[format_key]
+        size = format.size_of(data)
+        crc_size = self.crc_size if format.crc_size is None else format.crc_size
+        if self.fake_prefix and format.header:
+            return size + crc_size
+        if format.crc and self.crc16:
+            return self.length + size + crc_size
+        return size
 
     def get_header(self, binary):
-        n = binary.find(b'=')
-        if n == -1:
-            # posiciones sin =, calcular la longitud de la trama con sus primero bytes
-            binary = self.check_crc(binary)
-            h = binary[:1]
-            binary = binary[1:]
-            format = self.get_codec(h)
-        else:
-            if n > 4:
-                # comandos de pantalla con = o que tengan un igual más adelante por casualidad
-                # if self.fake_prefix and int.from_bytes(binary[:self.fake_prefix - 1]) and binary[self.fake_prefix - 1]:
-                #     # comandos
-                #     binary = binary[4:]
-                # else:
-                #     # codec8
-                binary = self.check_crc(binary)
-                n = binary.find(b'=')
-                if n > 4 or n == -1:
-                    # si el igual está adelante no es parte del comando
-                    h = binary[:1]
-                    binary = binary[1:]
-                    format = self.get_codec(h)
-                    return format, binary
-            h = binary[0:n]
-            binary = binary[n + 1:]
-            format = self.get_format(h)
-        return format, binary
-
-    def decode(self, binary, codec=None):
+        """Returns the format of the frame and a memoryview of its payload without the header"""
+        format, start, end = self.find_format(binary)
+        return format, memoryview(binary)[start:end]
+
+    def find_format(self, binary, offset=0):
+        """
+        Returns the format of the frame at offset and the start and end offsets of its fields.
+        Only the first bytes are looked up, a frame that does not start with a header is a length-prefixed frame
+        whose CRC is checked before looking up the header or the codec of its payload.
+        """
+        end = len(binary)
+        format, start = self.match_header(binary, offset, end)
+        if format is not None:
+            return format, start, end
+        if not self.crc16:
+            raise DecodeError(f'Unknown header {bytes(binary[offset:offset + 8])}')
+        start, end = self.check_frame(binary, offset)
+        format, start = self.get_payload_format(binary, start, end)
+        return format, start, end
+
+    def match_header(self, binary, start, end):
+        """Returns the format whose header and = are at start and the offset of its fields, or None and start"""
+        for n in self.header_lengths:
+            if start + n < end and binary[start + n] == EQUAL:
+                format = self.header_dispatch.get(bytes(binary[start:start + n]))
+                if format is not None:
+                    return format, start + n + 1
+        return None, start
+
+    def get_payload_format(self, binary, start, end):
+        """Returns the format of a CRC checked payload and the offset where its fields start"""
+        format, offset = self.match_header(binary, start, end)
+        if format is not None:
+            return format, offset
+        if start >= end or binary[start] not in self.codec_dispatch:
+            raise DecodeError(f'Unknown codec {bytes(binary[start:start + 1])}')
+        return self.codec_dispatch[binary[start]], start + 1
+
+    def decode(self, binary, codec=None, columnar=False, lazy=False, fields=None, records=None, lazy_cache=True):
+        """
+        Decodes a complete frame, binary can be bytes, bytearray or memoryview.
+        In columnar mode the arrays are decoded as a dict of columns (numpy or array.array for the numbers).
+        In lazy mode the data is a RecordView, only the fields that are read are decoded. lazy_cache=False
+        decodes them again on every access instead of keeping them.
+        fields decodes only some fields, for example ['positions.time', 'positions.lat', 'positions.lng'].
+        records, 'slots' or 'tuple', decodes to compact record classes that encode also accepts.
+        """
         if codec is None:
-            format, binary = self.get_header(binary)
+            format, start, end = self.find_format(binary)
         else:
             # codec 8 u otro ya se sabe el codec
             format = self.formats[codec]
+            start, end = 0, len(binary)
             if format.crc and self.crc16:
-                binary = self.check_crc(binary)
-        data = format.decode(binary)
+                start, end = self.check_frame(binary)
+        if end < len(binary):
+            # the CRC is not part of the fields
+            binary = memoryview(binary)[:end]
+        data = format.decode(binary, start, columnar, lazy, fields, records, lazy_cache)
         if codec is None:
             return format.name, data
         return data
 
+    def decode_many(self, frames, codec=None, columnar=False):
+        """Decodes an iterable of complete frames, returns a list with the result of decode for each one"""
+        decode = self.decode
+        return [decode(binary, codec, columnar) for binary in frames]
+
+    def decode_parallel(self, frames, codec=None, columnar=False, workers=None, chunksize=256):
+        """
+        Same as decode_many but the frames are decoded in a pool of workers processes, by default one per CPU.
+        Use a ParallelDecoder to keep the pool between calls or to iterate the results of a large replay.
+        """
+        with ParallelDecoder(self, workers, chunksize) as decoder:
+            return list(decoder.decode(frames, codec, columnar))
+
+    def stream_decoder(self, codec=None, max_frame_size=65536):
+        """Returns a StreamDecoder to decode the frames of a byte stream with feed(chunk)"""
+        return StreamDecoder(self, codec=codec, max_frame_size=max_frame_size)
+
     def check_crc(self, binary):
-        length = int.from_bytes(binary[:self.length], 'big', signed=False)
-        clean_binary = binary[self.length:length + self.length]
-        crc = binary[length + self.length: length + self.length + self.crc_size]
+        start, end = self.check_frame(binary)
+        return binary[start:end]
+
+    def check_frame(self, binary, offset=0, value=None):
+        """
+        Validates the CRC of the frame starting at offset, returns the start and end offsets of its payload.
+        value is the CRC of the payload when it was already computed while the frame arrived.
+        """
+        start = offset + self.length
+        end = start + int.from_bytes(binary[offset:start], 'big', signed=False)
+        crc = binary[end:end + self.crc_size]
         crc_value = int.from_bytes(crc, self.crc_byteorder, signed=False)
         if not crc:
             raise CRCError(f'There is no CRC')
-        elif crc_value != self.crc16(clean_binary):
-            raise CRCError(f'CRC no coincide {crc} != {self.get_crc(clean_binary, None)}')
-        return clean_binary
+        if value is None:
+            value = self.crc16(memoryview(binary)[start:end])
+        if crc_value != value:
+            raise CRCError(f'CRC no coincide {bytes(crc)} != {value.to_bytes(self.crc_size, byteorder=self.crc_byteorder)}')
+        return start, end
 
     def config_crc(self, js):
-        self.crc16 = crcmod.mkCrcFun(int(js['poly'], 16), int(js['init'], 16), js['reverse'])
+        self.crc16 = make_crc(js, self.crc_backend)
         self.crc_byteorder = js['byte_order']
         if 'size' in js:
             self.crc_size = js['size']
@@ -0,0 +1,213 @@
+import collections
+import keyword
+import re
+
+from protobin.compiler import StructBlock
+from protobin.fields import ArrayField
+
+RECORD_KINDS = ('slots', 'tuple')
+
+
+def attribute_names(keys):
+    """Converts the keys of the fields to valid and unique attribute names, #events is n_events"""
+    names = []
+    for k in keys:
+        name = re.sub(r'\W', '_', k.replace('#', 'n_'))
+        if not name or name[0].isdigit() or keyword.iskeyword(name) or name.startswith('_'):
+            name = f'f_{name}'
+        while name in names:
+            name += '_'
+        names.append(name)
+    return names
+
+
+def class_name(name):
+    return ''.join(part.capitalize() for part in re.split(r'\W|_', name) if part) or 'Record'
+
+
+class RecordMixin:
+    """
+    Methods of the record classes, the values are read by attribute or by the key of the field, record['#events'],
+    and get makes them valid data for encode.
+    """
+    __slots__ = ()
+    _keys = ()
+    _attrs = {}
+
+    def get(self, key, default=None):
+        attr = self._attrs.get(key)
+        if attr is None:
+            return default
+        return getattr(self, attr)
+
+    def keys(self):
+        return self._keys
+
+    def items(self):
+        return [(k, getattr(self, attr)) for k, attr in self._attrs.items()]
+
+    def to_dict(self):
+        data = {}
+        for k, attr in self._attrs.items():
+            val = getattr(self, attr)
+            if isinstance(val, list):
+                val = [v.to_dict() if isinstance(v, RecordMixin) else v for v in val]
+            data[k] = val
+        return data
+
+
+class SlotsRecord(RecordMixin):
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for attr, val in zip(self.__slots__, values):
+            setattr(self, attr, val)
+
+    def __getitem__(self, key):
+        return getattr(self, self._attrs[key])
+
+    def __eq__(self, other):
+        if isinstance(other, RecordMixin):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        values = ', '.join(f'{attr}={getattr(self, attr)!r}' for attr in self.__slots__)
+        return f'{self.__class__.__name__}({values})'
+
+
+class TupleRecord(RecordMixin):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, self._attrs[key])
+        return tuple.__getitem__(self, key)
+
+
+def record_class(name, keys, kind='slots'):
+    """Returns a __slots__ class or a NamedTuple with a value for each key"""
+    attrs = attribute_names(keys)
+    namespace = {'_keys': tuple(keys), '_attrs': dict(zip(keys, attrs))}
+    if kind == 'tuple':
+        namespace['__slots__'] = ()
+        return type(name, (TupleRecord, collections.namedtuple(name, attrs)), namespace)
+    if kind == 'slots':
+        namespace['__slots__'] = tuple(attrs)
+        # an __init__ with an argument per attribute is faster than setattr in a loop
+        args = ''.join(f', {attr}=None' for attr in attrs)
+        body = ''.join(f'\n    self.{attr} = {attr}' for attr in attrs) or '\n    pass'
+        exec(f'def __init__(self{args}):{body}', namespace)
+        return type(name, (SlotsRecord,), namespace)
+    raise ValueError(f'Invalid record kind {kind}, these are the available kinds {RECORD_KINDS}')
+
+
+class RecordType:
+    """
+    Record class of a list of fields and of the elements of its arrays. decode_from decodes the compiled plan
+    of the fields straight into records, convert converts dicts already decoded.
+    """
+
+    def __init__(self, name, fields, kind='slots', plan=None):
+        keys = []
+        self.arrays = {}
+        for f in fields:
+            keys.extend(f.keys or [f.key])
+            if isinstance(f, ArrayField):
+                self.arrays[f.key] = RecordType(f'{name}_{f.key}', f.fields, kind, f.plan)
+        self.cls = record_class(class_name(name), keys, kind)
+        self.tuple = kind == 'tuple'
+        self.decode_from = self.decode_function(fields if plan is None else plan)
+
+    def __repr__(self):
+        return f'RecordType<{self.cls.__name__}: {list(self.cls._keys)}>'
+
+    def convert(self, data):
+        for k, record_type in self.arrays.items():
+            val = data.get(k)
+            # columnar arrays stay as dicts of columns
+            if isinstance(val, list):
+                data[k] = [record_type.convert(item) for item in val]
+        get = data.get
+        return self.cls(*[get(k) for k in self.cls._keys])
+
+    def record(self, values):
+        """Returns the source that builds the record of the values, the class is cls"""
+        if self.tuple:
+            return f'tuple.__new__(cls, ({", ".join(values)},))'
+        return f'cls({", ".join(values)})'
+
+    def decode_function(self, plan):
+        """
+        Generates the function that decodes a record and the records of its arrays without building their dicts,
+        decode_from(binary, offset) returns the record and the offset where it ends. The elements of an array
+        of a single StructBlock, like the events of codec 8, are unpacked with iter_unpack in one comprehension.
+        """
+        namespace = {'cls': self.cls}
+        lines = ['def decode_from(binary, offset=0):']
+        values = []
+
+        def add(prefix, obj):
+            name = f'{prefix}{len(namespace)}'
+            namespace[name] = obj
+            return name
+
+        flat = len(plan) == 1 and isinstance(plan[0], StructBlock)
+        for f in plan:
+            if isinstance(f, StructBlock):
+                names = [f'v{len(values) + i}' for i in range(len(f.fields))]
+                lines.append(f'    if len(binary) - offset < {f.bytes}:')
+                # the fields raise their DecodeError
+                lines.append(f'        {add("block", f)}.decode_into(binary, offset, {{}})')
+                lines.append(f'    {", ".join(names)}, = {add("unpack", f.struct.unpack_from)}(binary, offset)')
+                lines.append(f'    offset += {f.bytes}')
+                values += [f'{add("conv", conv)}({name})' if conv else name
+                           for name, (k, conv) in zip(names, f.converters)]
+            elif isinstance(f, ArrayField):
+                item = self.arrays[f.key]
+                name = f'v{len(values)}'
+                lines.append('    length = binary[offset]')
+                lines.append('    offset += 1')
+                if item.rows is not None:
+                    width = item.rows_block.bytes
+                    lines.append(f'    end = offset + length * {width}')
+                    lines.append('    if end <= len(binary):')
+                    lines.append(f'        {name} = {add("rows", item.rows)}'
+                                 f'({add("iter", item.rows_block.struct.iter_unpack)}(binary[offset:end]))')
+                    lines.append('        offset = end')
+                    lines.append('    else:')
+                    indent = '        '
+                else:
+                    indent = '    '
+                decode = add('item', item.decode_from)
+                lines.append(f'{indent}{name} = []')
+                lines.append(f'{indent}for i in range(length):')
+                lines.append(f'{indent}    record, offset = {decode}(binary, offset)')
+                lines.append(f'{indent}    {name}.append(record)')
+                values.append(name)
+            elif f.keys:
+                # fields of many keys, like flags, decode them in a dict
+                data = f'd{len(values)}'
+                lines.append(f'    {data} = {{}}')
+                lines.append(f'    offset = {add("decode", f.decode_into)}(binary, offset, {data})')
+                values += [f'{data}[{k!r}]' for k in f.keys]
+            else:
+                name = f'v{len(values)}'
+                lines.append(f'    {name}, offset = {add("decode", f.decode)}(binary, offset)')
+                values.append(name)
+        lines.append(f'    return {self.record(values)}, offset')
+        self.rows = self.rows_block = None
+        if flat:
+            block = plan[0]
+            names = [f'v{i}' for i in range(len(block.fields))]
+            converted = [f'{add("conv", conv)}({name})' if conv else name
+                         for name, (k, conv) in zip(names, block.converters)]
+            lines.append('def rows(rows):')
+            lines.append(f'    return [{self.record(converted)} for {", ".join(names)}, in rows]')
+            self.rows_block = block
+        exec('\n'.join(lines), namespace)
+        if flat:
+            self.rows = namespace['rows']
+        return namespace['decode_from']
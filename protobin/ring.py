@@ -0,0 +1,213 @@
+import multiprocessing
+import pickle
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+from protobin.parallel import protocol_source
+
+# head and tail counters in their own cache lines, followed by the records
+HEAD = 0
+TAIL = 64
+DATA = 128
+COUNTER = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+# length of the record that marks the jump to the start of the ring
+WRAP = 0xFFFFFFFF
+
+
+def attach_memory(name):
+    # only the creator unlinks it, the resource tracker of another process would destroy it at exit
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    memory = shared_memory.SharedMemory(name)
+    if multiprocessing.parent_process() is None:
+        # the children of the creator share its tracker
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+class FrameRing:
+    """
+    Single producer, single consumer ring of length-prefixed records in shared memory, a record takes at
+    most half of it.
+    The producer appends with put, the consumer receives a memoryview of the record inside the ring with get,
+    which stays valid until release, so a frame is decoded in place without copies.
+    The other process attaches to the ring with FrameRing(name).
+    """
+
+    def __init__(self, name=None, size=1 << 20):
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=DATA + size)
+            self.owner = True
+        else:
+            self.memory = attach_memory(name)
+            self.owner = False
+        self.name = self.memory.name
+        self.buf = self.memory.buf
+        self.capacity = len(self.buf) - DATA
+        self.data = self.buf[DATA:DATA + self.capacity]
+        self.pending = None
+        self.view = None
+
+    def __repr__(self):
+        return f'FrameRing<name: {self.name}, capacity: {self.capacity}>'
+
+    def __len__(self):
+        return COUNTER.unpack_from(self.buf, HEAD)[0] - COUNTER.unpack_from(self.buf, TAIL)[0]
+
+    def put(self, binary):
+        """Appends a record, returns False when the ring has not space for it"""
+        need = LENGTH.size + len(binary)
+        # a record up to half the ring fits at the end or before its position, bigger ones could wait forever
+        if need > self.capacity // 2:
+            raise ValueError(f'{self}: a record of {len(binary)} bytes does not fit in the ring')
+        head = COUNTER.unpack_from(self.buf, HEAD)[0]
+        tail = COUNTER.unpack_from(self.buf, TAIL)[0]
+        pos = head % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < need else 0
+        if head + skip + need - tail > self.capacity:
+            return False
+        if skip:
+            if skip >= LENGTH.size:
+                LENGTH.pack_into(self.data, pos, WRAP)
+            head += skip
+            pos = 0
+        LENGTH.pack_into(self.data, pos, len(binary))
+        self.data[pos + LENGTH.size:pos + need] = binary
+        # the record is written before it is published
+        COUNTER.pack_into(self.buf, HEAD, head + need)
+        return True
+
+    def get(self):
+        """Returns a memoryview of the next record, None when the ring is empty"""
+        head = COUNTER.unpack_from(self.buf, HEAD)[0]
+        tail = COUNTER.unpack_from(self.buf, TAIL)[0]
+        if tail == head:
+            return None
+        pos = tail % self.capacity
+        if self.capacity - pos < LENGTH.size or LENGTH.unpack_from(self.data, pos)[0] == WRAP:
+            tail += self.capacity - pos
+            pos = 0
+        length = LENGTH.unpack_from(self.data, pos)[0]
+        self.pending = tail + LENGTH.size + length
+        self.view = self.data[pos + LENGTH.size:pos + LENGTH.size + length]
+        return self.view
+
+    def release(self):
+        """Frees the record returned by get, its memoryview must not be used anymore"""
+        self.view.release()
+        self.view = None
+        COUNTER.pack_into(self.buf, TAIL, self.pending)
+
+    def wait_put(self, binary, timeout=None, interval=0.0001):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.put(binary):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'{self} is full')
+            time.sleep(interval)
+
+    def wait_get(self, timeout=None, interval=0.0001):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            view = self.get()
+            if view is not None:
+                return view
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'{self} is empty')
+            time.sleep(interval)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+        self.data.release()
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def run_decoder(source, input_name, output_name, codec, columnar):
+    """
+    Loop of a decoder process, it decodes the frames of the input ring in place and puts the pickled results
+    in the output ring. The errors are sent as results, an empty frame stops it.
+    """
+    from protobin.protocol import Protocol
+    protocol = Protocol(**source)
+    frames = FrameRing(input_name)
+    results = FrameRing(output_name)
+    try:
+        while True:
+            view = frames.wait_get()
+            if not view:
+                frames.release()
+                break
+            try:
+                result = protocol.decode(view, codec, columnar)
+            except Exception as e:
+                # without the traceback, its frames reference the record
+                result = e.with_traceback(None)
+            finally:
+                del view
+                frames.release()
+            results.wait_put(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        results.wait_put(b'')
+    finally:
+        frames.close()
+        results.close()
+
+
+class DecodePipeline:
+    """
+    Decoder processes fed through shared memory rings instead of queues. Every lane has an input ring,
+    where one reader writes the raw frames, a decoder process and an output ring with the results.
+    Readers in other processes attach to the input ring of their lane with FrameRing(pipeline.inputs[lane]).
+    The results of a lane keep the order of its frames, failed frames return their exception, like a
+    DecodeError or a CRCError.
+    """
+
+    def __init__(self, protocol, lanes=1, size=1 << 20, codec=None, columnar=False, mp_context=None):
+        context = mp_context or multiprocessing.get_context()
+        source = protocol_source(protocol)
+        self.frames = [FrameRing(size=size) for i in range(lanes)]
+        self.results = [FrameRing(size=size) for i in range(lanes)]
+        self.inputs = [ring.name for ring in self.frames]
+        self.processes = [context.Process(target=run_decoder, daemon=True,
+                                          args=(source, frames.name, results.name, codec, columnar))
+                          for frames, results in zip(self.frames, self.results)]
+        for p in self.processes:
+            p.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def send(self, binary, lane=0, timeout=None):
+        """Writes a frame to the input ring of a lane, waits while it is full"""
+        self.frames[lane].wait_put(binary, timeout)
+
+    def receive(self, lane=0, timeout=None):
+        """Returns the next result of a lane, None after the lane was stopped"""
+        ring = self.results[lane]
+        view = ring.wait_get(timeout)
+        result = pickle.loads(view) if view else None
+        ring.release()
+        return result
+
+    def stop(self, lane=0):
+        self.frames[lane].wait_put(b'')
+
+    def close(self):
+        for frames, p in zip(self.frames, self.processes):
+            if p.is_alive():
+                frames.put(b'')
+        for p in self.processes:
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+        for ring in self.frames + self.results:
+            ring.close()
@@ -1,17 +1,134 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
 from protobin import Protocol
 
+# default of the arguments of configure that are not changed
+UNSET = object()
+
+
+class LoadedProtocol:
+
+    def __init__(self, protocol, mtime):
+        self.protocol = protocol
+        self.mtime = mtime
+        self.checked = time.monotonic()
+
 
 class ProtobinLoader(object):
+    """
+    Registry of the protocols of the files, ProtobinLoader(path, server) returns the same Protocol every time.
+    It is thread safe: a protocol is loaded once even when many threads ask for it at the same time.
+    The registry keeps the max_size protocols used last. With hot_reload the file is checked at most every
+    hot_reload seconds, when it changed the new Protocol replaces the old one, which is kept by the callers
+    that are still using it. A file that can not be loaded, like one being saved, keeps the old Protocol
+    until it changes again.
+    """
     __instance = None
-    protocols = {}
+    protocols = collections.OrderedDict()
+    loading = {}
+    lock = threading.Lock()
+    max_size = 128
+    hot_reload = None
+    stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'reload_errors': 0, 'evictions': 0, 'load_time': 0.0}
 
     def __new__(cls, path, server=None):
         if ProtobinLoader.__instance is None:
             ProtobinLoader.__instance = object.__new__(cls)
         return ProtobinLoader.__instance.get(path, server)
 
+    @classmethod
+    def configure(cls, max_size=UNSET, hot_reload=UNSET):
+        """Changes only the settings that are passed, hot_reload=None disables it"""
+        with cls.lock:
+            if max_size is not UNSET:
+                cls.max_size = max_size
+            if hot_reload is not UNSET:
+                cls.hot_reload = hot_reload
+            cls.evict()
+
+    @classmethod
+    def get_stats(cls):
+        with cls.lock:
+            return dict(cls.stats, size=len(cls.protocols))
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.protocols.clear()
+            for k in cls.stats:
+                cls.stats[k] = 0
+
     def get(self, path, server):
         key = f'{path}|{server}'
-        if key not in self.protocols:
-            self.protocols[key] = Protocol(file=path, server=server)
-        return self.protocols[key]
+        with self.lock:
+            entry = self.protocols.get(key)
+            if entry is not None and not self.modified(path, entry):
+                self.protocols.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry.protocol
+            future = self.loading.get(key)
+            if future is None:
+                future = self.loading[key] = concurrent.futures.Future()
+                self.stats['reloads' if entry else 'misses'] += 1
+                loader = True
+            else:
+                self.stats['hits'] += 1
+                if entry is not None:
+                    # it is being reloaded, the old protocol is used meanwhile
+                    return entry.protocol
+                loader = False
+        if loader:
+            return self.load(key, path, server, future, entry)
+        # another thread is loading it
+        return future.result()
+
+    def modified(self, path, entry):
+        if self.hot_reload is None or time.monotonic() - entry.checked < self.hot_reload:
+            return False
+        entry.checked = time.monotonic()
+        try:
+            return os.stat(path).st_mtime_ns != entry.mtime
+        except OSError:
+            # a removed file keeps the loaded protocol
+            return False
+
+    def load(self, key, path, server, future, entry=None):
+        """Loads the protocol out of the lock and publishes it to the threads waiting for it"""
+        mtime = None
+        try:
+            start = time.perf_counter()
+            mtime = os.stat(path).st_mtime_ns
+            protocol = Protocol(file=path, server=server, cache=True)
+        except BaseException as e:
+            # a reload that fails keeps the old protocol, the file is loaded again when it changes
+            keep = entry is not None and isinstance(e, Exception)
+            with self.lock:
+                del self.loading[key]
+                if keep:
+                    self.stats['reload_errors'] += 1
+                    if mtime is not None:
+                        # the failed version is not loaded again, only the next change of the file
+                        entry.mtime = mtime
+            if keep:
+                future.set_result(entry.protocol)
+                return entry.protocol
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.stats['load_time'] += time.perf_counter() - start
+            self.protocols[key] = LoadedProtocol(protocol, mtime)
+            self.protocols.move_to_end(key)
+            self.evict()
+        future.set_result(protocol)
+        return protocol
+
+    @classmethod
+    def evict(cls):
+        while len(cls.protocols) > cls.max_size:
+            cls.protocols.popitem(last=False)
+            cls.stats['evictions'] += 1
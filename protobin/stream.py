@@ -0,0 +1,160 @@
+from protobin.errors import CRCError, DecodeError
+
+
+class PayloadError(Exception):
+    """A length-prefixed frame with a valid CRC whose payload can not be decoded"""
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for a TCP byte stream of a protocol.
+    Chunks of any size are given to feed, which returns the (format_name, data) of every complete frame.
+    Incomplete frames stay buffered until the next chunk, and the bytes of a frame with a bad CRC or an
+    unknown header are dropped one by one until a valid frame is found again. A frame with a valid CRC
+    that can not be decoded is dropped as a whole.
+    The CRC of a length-prefixed frame is updated with every chunk, so it is not computed again at the end.
+    Frames without length prefix are decoded as soon as their fields are complete, if one of them stays
+    undecodable for more than max_frame_size bytes it is dropped too.
+    """
+
+    def __init__(self, protocol, codec=None, max_frame_size=65536):
+        self.protocol = protocol
+        # format of the frames without header, like the teltonika login
+        self.codec = codec
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.offset = 0
+        self.frame_end = 0
+        self.errors = 0
+        # CRC of the part already received of the length-prefixed frame at crc_frame
+        self.crc_frame = None
+        self.crc_done = 0
+        self.crc_value = None
+        self.prefixes = [h + b'=' for h in protocol.header_dispatch]
+        self.header_size = max([len(p) for p in self.prefixes], default=0)
+
+    def __repr__(self):
+        return f'StreamDecoder<buffered: {len(self.buffer) - self.offset}, errors: {self.errors}>'
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        frames = []
+        view = memoryview(self.buffer)
+        try:
+            while self.offset < len(self.buffer):
+                frame = self.next_frame(view)
+                if frame is None:
+                    break
+                frames.append(frame)
+        finally:
+            view.release()
+        if self.crc_frame is not None:
+            self.crc_frame = self.crc_frame - self.offset if self.crc_frame >= self.offset else None
+        del self.buffer[:self.offset]
+        self.offset = 0
+        return frames
+
+    def next_frame(self, view):
+        """Decodes the frame at the current offset, returns None when more data is needed"""
+        while self.offset < len(self.buffer):
+            try:
+                frame = self.read_frame(view)
+            except (CRCError, PayloadError):
+                # the frame is complete but corrupted, it is dropped as a whole
+                self.errors += 1
+                self.offset = self.frame_end
+                continue
+            except Exception:
+                # any error of an unframeable or undecodable frame resyncs, the exception and the slices
+                # of the buffer its traceback keeps are freed here
+                frame = False
+            if frame is None and len(self.buffer) - self.offset <= self.max_frame_size:
+                return None
+            if frame:
+                return frame
+            # resync
+            self.errors += 1
+            self.offset += 1
+        return None
+
+    def read_frame(self, view):
+        """
+        Returns the frame at the current offset, None if it is incomplete and False if it can not be framed.
+        A frame is consumed only when it is complete and valid.
+        """
+        protocol = self.protocol
+        buffer = self.buffer
+        offset = self.offset
+        if self.codec:
+            format = protocol.formats[self.codec]
+            if format.crc and protocol.crc16:
+                return self.read_crc_frame(view, format)
+            return self.read_fields(view, format, offset, 0)
+        format, start = protocol.match_header(buffer, offset, len(buffer))
+        if format is not None:
+            crc_size = 0
+            if protocol.fake_prefix and protocol.crc16:
+                crc_size = format.crc_size or protocol.crc_size
+            return self.read_fields(view, format, start, crc_size)
+        rest = buffer[offset:offset + self.header_size]
+        if len(rest) < self.header_size and any(p.startswith(rest) for p in self.prefixes):
+            # not enough bytes to tell the header
+            return None
+        if protocol.crc16:
+            return self.read_crc_frame(view, None)
+        return False
+
+    def read_fields(self, view, format, offset, crc_size):
+        if len(self.buffer) - offset < format.min_size + crc_size:
+            # the shortest message of the format is not buffered yet
+            return None
+        try:
+            data, end = format.decode_from(view, offset)
+        except (DecodeError, IndexError, UnicodeDecodeError):
+            # the fields go beyond the buffered data
+            return None
+        except Exception:
+            # a value that can not be decoded, like a timestamp out of range
+            return False
+        if end + crc_size > len(self.buffer):
+            return None
+        self.frame_end = end + crc_size
+        if crc_size:
+            crc = int.from_bytes(view[end:end + crc_size], self.protocol.crc_byteorder, signed=False)
+            if crc != self.protocol.crc16(view[self.offset:end]):
+                raise CRCError('CRC no coincide')
+        self.offset = self.frame_end
+        return format.name, data
+
+    def read_crc_frame(self, view, format):
+        protocol = self.protocol
+        offset = self.offset
+        start = offset + protocol.length
+        if start > len(self.buffer):
+            return None
+        length = int.from_bytes(view[offset:start], 'big', signed=False)
+        if length > self.max_frame_size:
+            return False
+        end = start + length
+        if self.crc_frame != offset:
+            self.crc_frame = offset
+            self.crc_done = 0
+            self.crc_value = None
+        available = min(end, len(self.buffer))
+        if available > start + self.crc_done:
+            self.crc_value = protocol.crc16(view[start + self.crc_done:available], self.crc_value)
+            self.crc_done = available - start
+        if end + protocol.crc_size > len(self.buffer):
+            return None
+        self.frame_end = end + protocol.crc_size
+        protocol.check_frame(view, offset, self.crc_value)
+        payload = view[:end]
+        try:
+            if format is None:
+                format, start = protocol.get_payload_format(self.buffer, start, end)
+            data = format.decode(payload, start)
+        except Exception as e:
+            # the length is right, resyncing byte by byte would read a length inside the frame
+            raise PayloadError(str(e)) from e
+        self.offset = self.frame_end
+        return format.name, data
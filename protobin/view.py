@@ -0,0 +1,112 @@
+import collections.abc
+
+from protobin.compiler import StructBlock
+from protobin.errors import DecodeError
+from protobin.fields import ArrayField
+
+
+class RecordView(collections.abc.Mapping):
+    """
+    Lazy decoded message. The offsets of the fields are found in one pass that only reads the length prefixes,
+    every value is decoded when it is accessed and, with cache, kept for the next access.
+    Arrays are ArrayViews of RecordViews. The view keeps a reference to binary, which must not change while
+    the view is used; to_dict decodes everything.
+    """
+
+    def __init__(self, plan, binary, offset=0, cache=True):
+        self.binary = binary
+        self.cache = cache
+        self.values = {}
+        self.slots = {}
+        for f in plan:
+            if isinstance(f, StructBlock):
+                for field in f.fields:
+                    self.slots[field.key] = field, offset
+                    offset += field.bytes
+                continue
+            for k in f.keys or [f.key]:
+                self.slots[k] = f, offset
+            offset = f.skip(binary, offset)
+        if offset > len(binary):
+            raise DecodeError(f'Binary has not enough data for {len(self.slots)} fields, {offset} bytes expected')
+        self.end = offset
+
+    def __repr__(self):
+        return f'RecordView<keys: {list(self.slots)}>'
+
+    def __getitem__(self, key):
+        if key in self.values:
+            return self.values[key]
+        field, offset = self.slots[key]
+        if isinstance(field, ArrayField):
+            val = ArrayView(field, self.binary, offset, self.cache)
+        else:
+            val, end = field.decode(self.binary, offset)
+            if field.keys:
+                if self.cache:
+                    self.values.update((k, val[k]) for k in field.keys)
+                return val[key]
+        if self.cache:
+            self.values[key] = val
+        return val
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def to_dict(self):
+        data = {}
+        for k in self.slots:
+            val = self[k]
+            data[k] = val.to_list() if isinstance(val, ArrayView) else val
+        return data
+
+
+class ArrayView(collections.abc.Sequence):
+    """
+    Lazy array of RecordViews. The elements of fixed-width arrays are found by arithmetic, the others with
+    one pass over the lengths of their variable fields.
+    """
+
+    def __init__(self, field, binary, offset, cache=True):
+        self.field = field
+        self.binary = binary
+        self.cache = cache
+        self.items = {}
+        length = binary[offset]
+        offset += 1
+        if field.stride is not None:
+            self.offsets = range(offset, offset + length * field.stride, field.stride)
+        else:
+            self.offsets = []
+            for i in range(length):
+                self.offsets.append(offset)
+                for f in field.plan:
+                    offset = f.skip(binary, offset)
+
+    def __repr__(self):
+        return f'ArrayView<key: {self.field.key}, length: {len(self.offsets)}>'
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        offset = self.offsets[i]
+        if offset in self.items:
+            return self.items[offset]
+        item = RecordView(self.field.plan, self.binary, offset, self.cache)
+        if self.cache:
+            self.items[offset] = item
+        return item
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def to_list(self):
+        return [item.to_dict() for item in self]
@@ -1,11 +1,30 @@
 import unittest
+import unittest.mock
 
+import asyncio
 import datetime
 import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import threading
+import tempfile
 import yaml
 from protobin import Protocol
-from protobin.errors import InputError, FormatError
+from protobin.bits import Bitset
+from protobin.capture import CaptureReader, CaptureWriter
+from protobin.crc import make_crc
+from protobin.errors import InputError, FormatError, DecodeError, CRCError
 from protobin import ProtobinLoader
+from protobin.aio import ProtobinProtocol, FrameReader, FrameWriter
+from protobin.bench import bench_fields, bench_formats, regressions, sample_data
+from protobin.columnar import get_numpy
+from protobin.compiler import StructBlock
+from protobin.parallel import ParallelDecoder, protocol_source
+from protobin.ring import DecodePipeline, FrameRing
+from protobin.view import ArrayView, RecordView
 
 DATA = {
         'positions': [
@@ -247,6 +266,26 @@ class BasicTest(unittest.TestCase):
         h, recv = self.protocol.decode(binary)
         self.assertEqual(data, recv)
 
+    def test_bits_output(self):
+        protocol = Protocol(js={'formats': {'bits': {'fields': {
+            'entero': {'type': 'bits', 'length': 12, 'output': 'int'},
+            'set': {'type': 'bits', 'output': 'bitset'},
+            'lista': {'type': 'bits'}}}}})
+        lista = [i % 3 == 0 for i in range(40)]
+        binary = protocol.encode({'entero': 0b100000000101, 'set': lista[:10], 'lista': lista}, 'bits')
+        self.assertEqual(binary[:2], b'\x80\x50')
+        data = protocol.decode(binary, 'bits')
+        self.assertEqual(data['entero'], 0b100000000101)
+        self.assertIsInstance(data['set'], Bitset)
+        self.assertEqual(data['set'], lista[:10])
+        self.assertEqual((data['set'][3], data['set'][-1], int(data['set'])), (True, True, 0b1001001001))
+        self.assertEqual(data['lista'], lista)
+        self.assertEqual(protocol.encode(data, 'bits'), binary)
+        with self.assertRaises(ValueError):
+            protocol.encode({'entero': 1 << 12, 'set': [], 'lista': []}, 'bits')
+        with self.assertRaises(ValueError):
+            Protocol(js={'formats': {'bits': {'fields': {'entero': {'type': 'bits', 'output': 'int'}}}}})
+
     def test_bool(self):
         data = {'test': False}
         binary = self.protocol.encode(data, 'bool')
@@ -352,6 +391,23 @@ class BasicTest(unittest.TestCase):
         h, recv = self.protocol.decode(binary)
         self.assertEqual(data, recv)
 
+    def test_bcd_cache(self):
+        protocol = Protocol(js={'formats': {'fecha': {'fields': {
+            'date': {'type': 'date', 'cache': True},
+            'time': {'type': 'time', 'cache': True},
+            'count': {'type': 'unsigned', 'bytes': 1},
+            'datetime': {'type': 'datetime', 'cache': True}}}}})
+        self.assertIsInstance(protocol.formats['fecha'].input_plan[1], StructBlock)
+        data = {'date': datetime.date(2024, 9, 13), 'time': datetime.time(15, 23), 'count': 3,
+                'datetime': datetime.datetime(2024, 9, 13, 15, 23, 51)}
+        binary = protocol.encode(data, 'fecha')
+        self.assertEqual(binary, b'\x13\x09\x24\x15\x23\x03\x13\x09\x24\x15\x23\x51')
+        first = protocol.decode(binary, 'fecha')
+        second = protocol.decode(binary, 'fecha')
+        self.assertEqual(first, data)
+        self.assertIs(first['date'], second['date'])
+        self.assertIs(first['datetime'], second['datetime'])
+
     def test_flags(self):
         data = {'f1': True, 'f2': False, 'f3': False, 'f4': True}
         binary = self.protocol.encode(data, 'flags')
@@ -467,6 +523,33 @@ class BasicTest(unittest.TestCase):
         h, recv = self.protocol.decode(binary)
         self.assertEqual(data, recv)
 
+    def test_timestamp_tz(self):
+        protocol = Protocol(js={'formats': {'tiempo': {'fields': {
+            'utc': {'type': 'timestamp', 'bytes': 8, 'tz': 'utc'},
+            'naive': {'type': 'timestamp', 'bytes': 8, 'tz': 'naive'},
+            'lima': {'type': 'timestamp', 'bytes': 8, 'decimals': 3, 'tz': 'America/Lima'},
+            'raw': {'type': 'timestamp', 'bytes': 6, 'decimals': 3, 'output': 'int'},
+            'local': {'type': 'timestamp', 'bytes': 6}}}}})
+        utc = datetime.datetime(2024, 9, 13, 20, 23, 51, 265981, tzinfo=datetime.timezone.utc)
+        binary = protocol.encode({'utc': utc, 'naive': utc.replace(tzinfo=None), 'lima': utc, 'raw': 1726259031265,
+                                  'local': None}, 'tiempo')
+        self.assertEqual(len(binary), 36)
+        self.assertEqual(binary[:8], (1726259031265981).to_bytes(8, 'big'))
+        self.assertEqual(binary[:8], binary[8:16])
+        data = protocol.decode(binary, 'tiempo')
+        self.assertEqual(data['utc'], utc)
+        self.assertEqual(data['naive'], utc.replace(tzinfo=None))
+        self.assertEqual(data['lima'].utcoffset(), datetime.timedelta(hours=-5))
+        self.assertEqual(data['lima'], utc.replace(microsecond=265000))
+        self.assertEqual((data['raw'], data['local']), (1726259031265, None))
+        with self.assertRaises(ValueError):
+            Protocol(js={'formats': {'tiempo': {'fields': {'t': {'type': 'timestamp', 'tz': 'Nowhere/Lima'}}}}})
+        # python 3.8 without backports.zoneinfo
+        with unittest.mock.patch.dict(sys.modules, {'zoneinfo': None, 'backports.zoneinfo': None}):
+            with self.assertRaises(ValueError):
+                Protocol(js={'formats': {'tiempo': {'fields': {'t': {'type': 'timestamp', 'tz': 'America/Lima'}}}}})
+            Protocol(js={'formats': {'tiempo': {'fields': {'t': {'type': 'timestamp', 'tz': 'utc'}}}}})
+
 
 class AdvancedTest(unittest.TestCase):
 
@@ -961,3 +1044,838 @@ report:
         binary = client.encode(data, 'flag_array')
         h, recv = client.decode(binary)
         self.assertEqual(data, recv)
+
+
+class CompilerTest(unittest.TestCase):
+
+    def test_struct_blocks(self):
+        client = Protocol(file='codec8.json')
+        format = client.formats['status3']
+        blocks = [f for f in format.output_plan if isinstance(f, StructBlock)]
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0].struct.format, '>HBHBHBHBHBHBHB')
+        positions = client.formats['report'].input_plan[0]
+        self.assertIsInstance(positions.plan[1], StructBlock)
+
+    def test_struct_same_binary(self):
+        client = Protocol(file='codec8.json')
+        format = client.formats['status3']
+        data = {'status': 'E', 'direction': 'A', 'delay': -200, 'datero_bus_0': 70000, 'datero_dif_0': 3}
+        binary = b''.join(f.encode(data) for f in format.output_fields)
+        self.assertEqual(format.encode(data), b's=' + binary)
+
+    def test_struct_errors(self):
+        client = Protocol(file='codec8.json')
+        with self.assertRaises(ValueError):
+            client.encode({'datero_bus_0': -1}, 'status3')
+        protocol = Protocol(js={'formats': {'ack': {'fields': {
+            'positions': {'bytes': 4, 'type': 'unsigned'},
+            'last': {'bytes': 2, 'type': 'id'}
+        }}}})
+        with self.assertRaises(DecodeError):
+            protocol.decode(b'\x00\x00\x00\x01\x00', 'ack')
+
+    def test_frozen_fields(self):
+        client = Protocol(file='codec8.json')
+        positions = client.formats['report'].input_plan[0]
+        for f in positions.fields:
+            self.assertFalse(hasattr(f, '__dict__'))
+            with self.assertRaises(AttributeError):
+                f.bytes = 8
+        positions.vector_threshold = 1000
+        copy = pickle.loads(pickle.dumps(positions))
+        self.assertEqual(copy.stride, positions.stride)
+        self.assertEqual(copy.vector_threshold, 1000)
+        with self.assertRaises(AttributeError):
+            copy.key = 'other'
+
+
+class OffsetTest(unittest.TestCase):
+
+    def test_buffer_types(self):
+        client = Protocol(file='demo.json', server=False)
+        server = Protocol(file='demo.json', server=True)
+        binary = client.encode(DATA, 'report')
+        for buffer in (binary, bytearray(binary), memoryview(binary)):
+            name, recv = server.decode(buffer)
+            self.assertEqual(DATA, recv)
+
+    def test_decode_from(self):
+        client = Protocol(file='codec8.json')
+        format = client.formats['login']
+        binary = b'garbage' + client.encode({'serial': '359769037211486'}, 'login') + b'next'
+        data, offset = format.decode_from(memoryview(binary), 7)
+        self.assertEqual(data, {'serial': '359769037211486'})
+        self.assertEqual(binary[offset:], b'next')
+
+    def test_binary_leaf(self):
+        protocol = Protocol(js={'formats': {'bin': {'header': 'b', 'fields': {'test': {'type': 'binary'}}}}})
+        name, recv = protocol.decode(memoryview(protocol.encode({'test': b'\x00=\x01'}, 'bin')))
+        self.assertIsInstance(recv['test'], bytes)
+
+
+class EncodeIntoTest(unittest.TestCase):
+
+    def test_append(self):
+        client = Protocol(file='codec8.json')
+        data = {'status': 'E', 'direction': 'A', 'datero_bus_3': 256}
+        buf = bytearray(b'prev')
+        end = client.encode_into(buf, data, 'status3')
+        self.assertEqual(end, len(buf))
+        self.assertEqual(bytes(buf[4:]), client.encode(data, 'status3'))
+        end = client.encode_into(buf, {'serial': '359769037211486'}, 'login')
+        self.assertEqual(bytes(buf[end - 17:]), b'\x00\x0f359769037211486')
+
+    def test_length_prefix(self):
+        client = Protocol(file='codec8.json')
+        data = {'positions': [], '#reports': 0}
+        buf = bytearray()
+        client.encode_into(buf, data, 'report')
+        self.assertEqual(int.from_bytes(buf[:8], 'big'), 3)
+        self.assertEqual(client.decode(bytes(buf)), ('report', data))
+
+    def test_offset(self):
+        client = Protocol(file='codec8.json')
+        data = {'padron': '110', 'company': 'roma', 'route': 'IO37'}
+        buf = memoryview(bytearray(32))
+        end = client.encode_into(buf, data, 'login_status', 2)
+        self.assertEqual(bytes(buf[2:end]), b'P=\x03110\x04roma\x04IO37\x19\x8f')
+
+    def test_error_rollback(self):
+        client = Protocol(file='codec8.json')
+        buf = bytearray(b'prev')
+        with self.assertRaises(ValueError):
+            client.encode_into(buf, {'datero_bus_0': -1}, 'status3')
+        self.assertEqual(buf, b'prev')
+
+
+class StreamTest(unittest.TestCase):
+    status = b'S=RA\x07IQUITOS14:05\x06LOBATO\x04\x07IGLESIA\x00f\x08\x00n\x05\x00\x96\x03\x01m\x08\x00\xb5\r\x01w\t\x00\x00o\xb4'
+    report = b'\x00\x00\x00\x00\x00\x00\x00!\x08\x01\x00\x00\x01\x94\xd26B\xd8\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\xa4\x12'
+
+    def test_partial_reads(self):
+        client = Protocol(file='teltonika.json', server=None)
+        stream = self.status + self.report + self.status
+        for size in (1, 5, len(stream)):
+            decoder = client.stream_decoder()
+            frames = []
+            for i in range(0, len(stream), size):
+                frames += decoder.feed(stream[i:i + size])
+            self.assertEqual([name for name, data in frames], ['status1', 'report', 'status1'])
+            self.assertEqual(frames[1][1], client.decode(self.report)[1])
+            self.assertEqual(decoder.errors, 0)
+
+    def test_resync(self):
+        client = Protocol(file='teltonika.json', server=None)
+        decoder = client.stream_decoder()
+        bad_crc = self.report[:-1] + b'\x00'
+        frames = decoder.feed(b'xx' + bad_crc + self.report + self.status[:10])
+        self.assertEqual([name for name, data in frames], ['report'])
+        self.assertEqual(decoder.errors, 3)
+        frames = decoder.feed(self.status[10:])
+        self.assertEqual([name for name, data in frames], ['status1'])
+
+    def test_undecodable_payload(self):
+        client = Protocol(file='teltonika.json', server=None)
+        # a timestamp out of the range of datetime with a valid CRC
+        payload = bytearray(self.report[8:-client.crc_size])
+        payload[2:8] = b'\xff' * 6
+        bad = self.report[:8] + payload + client.crc16(payload).to_bytes(client.crc_size, client.crc_byteorder)
+        with self.assertRaises(ValueError):
+            client.decode(bad)
+        decoder = client.stream_decoder()
+        frames = decoder.feed(bad + self.report)
+        self.assertEqual([name for name, data in frames], ['report'])
+        self.assertEqual(decoder.errors, 1)
+        self.assertEqual(decoder.feed(self.report * 5), [('report', frames[0][1])] * 5)
+
+    def test_overflowing_field(self):
+        protocol = Protocol(js={'formats': {'medida': {'header': 'T', 'fields': {
+            'time': {'type': 'timestamp', 'bytes': 8, 'decimals': 0},
+            'id': {'type': 'unsigned', 'bytes': 1}}}}})
+        good = protocol.encode({'time': datetime.datetime(2024, 5, 1, 12), 'id': 7}, 'medida')
+        bad = b'T=' + b'\xff' * 8 + b'\x01'
+        with self.assertRaises(OverflowError):
+            protocol.decode(bad)
+        decoder = protocol.stream_decoder()
+        self.assertEqual(decoder.feed(bad + good), [protocol.decode(good)])
+        self.assertGreater(decoder.errors, 0)
+        self.assertEqual(decoder.feed(good * 2), [protocol.decode(good)] * 2)
+
+    def test_codec(self):
+        client = Protocol(file='codec8.json')
+        decoder = client.stream_decoder(codec='login')
+        binary = bytes.fromhex('000F333536333037303432343431303133')
+        self.assertEqual(decoder.feed(binary[:4]), [])
+        self.assertEqual(decoder.feed(binary[4:]), [('login', {'serial': '356307042441013'})])
+
+
+class AsyncioTest(unittest.IsolatedAsyncioTestCase):
+    report = StreamTest.report
+
+    async def test_loopback(self):
+        client = Protocol(file='teltonika.json', server=None)
+        received = []
+        writes = []
+
+        def on_frame(connection, name, data):
+            received.append(name)
+            if name == 'report':
+                connection.send({'positions': data['#reports']}, 'report_ack')
+                connection.send({'positions': len(received)}, 'report_ack')
+
+        class AckProtocol(ProtobinProtocol):
+            def flush(self):
+                writes.append(len(self.pending))
+                super().flush()
+
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: AckProtocol(client, on_frame), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        frames = FrameReader(reader, client, codec='report_ack')
+        writer.write(self.report[:20])
+        await writer.drain()
+        writer.write(self.report[20:] + StreamTest.status)
+        await writer.drain()
+        acks = [await frames.read_frame(), await frames.read_frame()]
+        self.assertEqual(acks, [('report_ack', {'positions': 0}), ('report_ack', {'positions': 1})])
+        self.assertEqual(writes, [8])
+        replies = FrameWriter(writer, client)
+        replies.send({'positions': 5}, 'report_ack')
+        await replies.drain()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        self.assertEqual(received, ['report', 'status1'])
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def test_decode_many(self):
+        client = Protocol(file='demo.json', server=False)
+        server = Protocol(file='demo.json', server=True)
+        binary = client.encode(DATA, 'report')
+        self.assertEqual(server.decode_many([binary, binary]), [('report', DATA)] * 2)
+
+    def test_columnar(self):
+        client = Protocol(file='demo.json', server=False)
+        server = Protocol(file='demo.json', server=True)
+        binary = client.encode(DATA, 'report')
+        name, recv = server.decode_many([binary], columnar=True)[0]
+        positions = recv['positions']
+        self.assertEqual(list(positions['speed']), [p['speed'] for p in DATA['positions']])
+        self.assertEqual(list(positions['lat']), [p['lat'] for p in DATA['positions']])
+        self.assertEqual(positions['mark'], [p['mark'] for p in DATA['positions']])
+        self.assertEqual(positions['time'], [p['time'] for p in DATA['positions']])
+        self.assertEqual(list(recv['events']['id']), [6])
+        self.assertEqual(recv['trip'], DATA['trip'])
+
+    def test_columnar_nested(self):
+        client = Protocol(file='codec8.json')
+        data = {'positions': [{'time': datetime.datetime(2024, 10, 19, 9, 37, 57, 555000), 'priority': 1, 'lng': -77.0155334, 'lat': -12.0613651, 'alt': 0, 'angle': 0, 'satellites': 3, 'speed': 105, 'event_io': 0, '#events': 2, 'events1b': [{'id': 21, 'value': 3}, {'id': 1, 'value': 1}], 'events2b': [], 'events4b': [], 'events8b': []}], '#reports': 1}
+        name, recv = client.decode(client.encode(data, 'report'), columnar=True)
+        positions = recv['positions']
+        self.assertEqual(list(positions['priority']), [1])
+        self.assertEqual(positions['events1b'], [data['positions'][0]['events1b']])
+
+    def test_lazy_numpy(self):
+        code = ('import sys, protobin; protobin.Protocol(file="tests/codec8.json"); print("numpy" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath('.')))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    @unittest.skipIf(get_numpy() is None, 'numpy is not installed')
+    def test_vector(self):
+        protocol = Protocol(js={'formats': {'events': {'header': 'E', 'fields': {'events': {'type': 'array', 'array': {
+            'id': {'type': 'id', 'bytes': 1},
+            'value': {'type': 'unsigned', 'bytes': 8},
+            'delta': {'type': 'signed', 'bytes': 2},
+            'lat': {'type': 'float', 'bytes': 4, 'decimals': 7},
+            'on': {'type': 'bool'}
+        }}}}}})
+        events = [{'id': i % 3, 'value': i * 2 ** 40, 'delta': -i, 'lat': -12.0613651 + i / 1000, 'on': i % 2 == 0}
+                  for i in range(40)]
+        binary = protocol.encode({'events': events}, 'events')
+        field = protocol.formats['events'].input_plan[0]
+        name, vector = protocol.decode(binary, columnar=True)
+        field.vector_threshold = 1000
+        name, elements = protocol.decode(binary, columnar=True)
+        for k in ('id', 'value', 'delta', 'lat', 'on'):
+            self.assertEqual(list(vector['events'][k]), list(elements['events'][k]))
+        self.assertEqual(vector['events']['id'][:3], [None, 1, 2])
+        self.assertEqual(list(vector['events']['lat']), [e['lat'] for e in protocol.decode(binary)[1]['events']])
+
+
+class CrcTest(unittest.TestCase):
+
+    def test_backends(self):
+        binary = bytes(range(256)) * 3
+        for js in ({'poly': '0x18005', 'init': '0x0000', 'reverse': True}, {'poly': '0x11021', 'init': '0xFFFF', 'reverse': False}):
+            crcmod_crc = make_crc(js, 'crcmod')
+            table_crc = make_crc(js, 'table')
+            self.assertEqual(table_crc(binary), crcmod_crc(binary))
+            self.assertEqual(table_crc(memoryview(binary)[10:]), crcmod_crc(binary[10:]))
+            state = table_crc.new().update(binary[:100]).update(memoryview(binary)[100:])
+            self.assertEqual(state.value, crcmod_crc(binary))
+
+    def test_protocol_backend(self):
+        data = {'status': 'E', 'direction': 'A', 'datero_bus_3': 256}
+        client = Protocol(file='codec8.json', crc_backend='table')
+        binary = client.encode(data, 'status3')
+        self.assertEqual(binary, Protocol(file='codec8.json').encode(data, 'status3'))
+        report = StreamTest.report
+        self.assertEqual(Protocol(file='teltonika.json', crc_backend='table').decode(report),
+                         Protocol(file='teltonika.json').decode(report))
+        with self.assertRaises(CRCError):
+            client.decode(report[:-1] + b'\x00')
+        with self.assertRaises(ValueError):
+            Protocol(file='codec8.json', crc_backend='invalid')
+
+
+class DispatchTest(unittest.TestCase):
+
+    def test_equal_in_payload(self):
+        protocol = Protocol(js={
+            "length": 8,
+            "crc": {"poly": "0x18005", "init": "0x0000", "reverse": True, "byte_order": "big", "size": 4},
+            'formats': {
+                "command": {
+                    "codec": 12,
+                    "fields": {
+                        "#commands1": {"bytes": 1, "type": "unsigned"},
+                        "command": {"length_size": 4, "type": "binary"}
+                    }
+                },
+                "status": {"header": "ST", "fields": {"text": {"type": "string"}}}
+            }})
+        data = {'#commands1': ord('='), 'command': b'A=B=C'}
+        binary = protocol.encode(data, 'command')
+        self.assertEqual(protocol.decode(binary), ('command', data))
+        self.assertEqual(protocol.decode(memoryview(binary)), ('command', data))
+        binary = protocol.encode({'text': 'a=b'}, 'status')
+        self.assertEqual(protocol.decode(memoryview(binary)), ('status', {'text': 'a=b'}))
+
+    def test_find_format(self):
+        client = Protocol(file='teltonika.json', server=None)
+        format, start, end = client.find_format(StreamTest.status)
+        self.assertEqual((format.name, start, end), ('status1', 2, len(StreamTest.status)))
+        format, start, end = client.find_format(StreamTest.report)
+        self.assertEqual((format.name, start, end), ('report', 9, len(StreamTest.report) - 4))
+
+    def test_unknown_header(self):
+        protocol = Protocol(js={'formats': {'medida': {'header': 'M', 'fields': {'id': {'bytes': 1, 'type': 'unsigned'}}}}})
+        with self.assertRaises(DecodeError):
+            protocol.decode(b'X=\x01')
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_suites(self):
+        results = bench_fields(['flags', 'array'], min_time=0.001)
+        self.assertEqual([r['name'] for r in results],
+                         ['field.flags.encode', 'field.flags.decode', 'field.array.encode', 'field.array.decode'])
+        results = bench_formats(['codec8.json'], sizes=(2,), min_time=0.001)
+        self.assertIn('format.codec8.json.report.decode[2]', [r['name'] for r in results])
+        self.assertTrue(all(r['ops'] > 0 and r['alloc'] > 0 for r in results))
+
+    def test_installed_package(self):
+        # the protocol files of the tests are not in the installed package
+        with unittest.mock.patch('protobin.bench.TESTS_PATH', os.path.join('not', 'installed')):
+            with self.assertRaisesRegex(FileNotFoundError, '--protocol'):
+                bench_formats(min_time=0.001)
+
+    def test_regressions(self):
+        baseline = {'a': {'ops': 100}, 'b': {'ops': 100}}
+        results = [{'name': 'a', 'ops': 95}, {'name': 'b', 'ops': 80}, {'name': 'c', 'ops': 1}]
+        self.assertEqual(regressions(results, baseline, 0.1), ['b'])
+
+
+class CodegenTest(unittest.TestCase):
+
+    def test_same_frames(self):
+        for file, server in [('codec8.json', None), ('teltonika.json', None), ('demo.json', False), ('demo.json', True)]:
+            protocol = Protocol(file=file, server=server)
+            generated = Protocol(file=file, server=server, backend='codegen', cache_dir=False)
+            for name, format in protocol.formats.items():
+                self.assertIsNotNone(generated.formats[name].decode_function)
+                for size in (0, 3):
+                    data = sample_data(format.output_fields, size)
+                    self.assertEqual(generated.encode(data, name), protocol.encode(data, name))
+                    if server is None:
+                        binary = protocol.encode(data, name)
+                        codec = None if format.header or (format.codec and protocol.crc16) else name
+                        self.assertEqual(generated.decode(binary, codec), protocol.decode(binary, codec))
+
+    def test_errors(self):
+        generated = Protocol(file='teltonika.json', backend='codegen', cache_dir=False)
+        with self.assertRaises(DecodeError):
+            generated.formats['status3'].decode(b'\x01')
+        with self.assertRaises(ValueError):
+            generated.encode({'positions': None}, 'report')
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            Protocol(file='teltonika.json', backend='codegen', cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            protocol = Protocol(file='teltonika.json', backend='codegen', cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            data = sample_data(protocol.formats['report'].output_fields, 2)
+            self.assertEqual(protocol.encode(data, 'report'), Protocol(file='teltonika.json').encode(data, 'report'))
+
+
+class CompiledCacheTest(unittest.TestCase):
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = shutil.copy('demo.yaml', folder)
+            protocol = Protocol(file=path, server=True, cache=True)
+            self.assertEqual(os.listdir(os.path.join(folder, '__protobin__')), ['demo.yaml.True.pickle'])
+            compiled = Protocol(file=path, server=True, cache=True)
+            self.assertIsNot(compiled.formats, protocol.formats)
+            data = sample_data(protocol.formats['login'].output_fields, 1)
+            self.assertEqual(compiled.encode(data, 'login'), protocol.encode(data, 'login'))
+            with open(path, 'a') as f:
+                f.write('\n')
+            os.utime(path, ns=(0, 0))
+            self.assertEqual(Protocol(file=path, server=True, cache=True).encode(data, 'login'),
+                             protocol.encode(data, 'login'))
+
+    def test_other_folder(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            shutil.copy('teltonika.json', folder)
+            os.makedirs(os.path.join(folder, 'other'))
+            try:
+                os.chdir(folder)
+                Protocol(file='teltonika.json', cache=True)
+                os.chdir('other')
+                compiled = Protocol(file='../teltonika.json', cache=True)
+                self.assertEqual(compiled.file, '../teltonika.json')
+                self.assertTrue(os.path.exists(protocol_source(compiled)['file']))
+            finally:
+                os.chdir(cwd)
+
+    def test_corrupted_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = shutil.copy('demo.yaml', folder)
+            protocol = Protocol(file=path, server=True, cache=True)
+            compiled = os.path.join(folder, '__protobin__', 'demo.yaml.True.pickle')
+            with open(compiled, 'rb') as f:
+                original = f.read()
+            data = sample_data(protocol.formats['login'].output_fields, 1)
+            for i in range(0, len(original), max(len(original) // 200, 1)):
+                with open(compiled, 'wb') as f:
+                    f.write(original[:i] + bytes([original[i] ^ 0xff]) + original[i + 1:])
+                self.assertEqual(Protocol(file=path, server=True, cache=True).encode(data, 'login'),
+                                 protocol.encode(data, 'login'))
+            with open(compiled, 'rb') as f:
+                self.assertEqual(f.read(), original)
+
+    def test_package_changed(self):
+        from protobin import cache
+        with tempfile.TemporaryDirectory() as folder:
+            path = shutil.copy('demo.yaml', folder)
+            Protocol(file=path, server=True, cache=True)
+            options = {'server': True, 'crc_backend': None, 'backend': None, 'cache_dir': None}
+            self.assertIsNotNone(cache.load_compiled(path, options))
+            # a compiled file of other version of protobin is not unpickled
+            with unittest.mock.patch.object(cache, 'package_digest', return_value='other'):
+                self.assertIsNone(cache.load_compiled(path, options))
+
+    def test_crc_and_codegen(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = shutil.copy('teltonika.json', folder)
+            Protocol(file=path, backend='codegen', cache_dir=False, cache=True)
+            compiled = Protocol(file=path, backend='codegen', cache_dir=False, cache=True)
+            self.assertIsNotNone(compiled.formats['report'].decode_function)
+            data = sample_data(compiled.formats['login_status'].output_fields, 1)
+            self.assertEqual(compiled.encode(data, 'login_status'), Protocol(file=path).encode(data, 'login_status'))
+
+    def test_lazy_yaml(self):
+        code = 'import sys, protobin; print("yaml" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath('.')))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class LoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        ProtobinLoader.clear()
+
+    def tearDown(self):
+        ProtobinLoader.configure(max_size=128, hot_reload=None)
+        ProtobinLoader.clear()
+
+    def test_single_flight(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ProtobinLoader('teltonika.json'))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(p) for p in results}), 1)
+        stats = ProtobinLoader.get_stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['size']), (1, 7, 1))
+
+    def test_eviction(self):
+        ProtobinLoader.configure(max_size=2)
+        codec8 = ProtobinLoader('codec8.json')
+        ProtobinLoader('demo.json', server=True)
+        self.assertIs(ProtobinLoader('codec8.json'), codec8)
+        ProtobinLoader('demo.json', server=False)
+        self.assertEqual(ProtobinLoader.get_stats()['evictions'], 1)
+        ProtobinLoader.configure(hot_reload=5)
+        ProtobinLoader.configure(max_size=3)
+        self.assertEqual((ProtobinLoader.max_size, ProtobinLoader.hot_reload), (3, 5))
+        ProtobinLoader.configure(max_size=2)
+        self.assertIs(ProtobinLoader('codec8.json'), codec8)
+        self.assertEqual(ProtobinLoader.get_stats()['misses'], 3)
+
+    def test_hot_reload(self):
+        ProtobinLoader.configure(hot_reload=0)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'medida.json')
+            js = {'formats': {'medida': {'header': 'M', 'fields': {'id': {'bytes': 1, 'type': 'unsigned'}}}}}
+            with open(path, 'w') as f:
+                json.dump(js, f)
+            protocol = ProtobinLoader(path)
+            self.assertIs(ProtobinLoader(path), protocol)
+            js['formats']['medida']['fields']['id']['bytes'] = 2
+            with open(path, 'w') as f:
+                json.dump(js, f)
+            os.utime(path, ns=(0, 0))
+            reloaded = ProtobinLoader(path)
+            self.assertIsNot(reloaded, protocol)
+            self.assertEqual(reloaded.encode({'id': 1}, 'medida'), b'M=\x00\x01')
+            self.assertEqual(protocol.encode({'id': 1}, 'medida'), b'M=\x01')
+            self.assertEqual(ProtobinLoader.get_stats()['reloads'], 1)
+            # a file being saved keeps the loaded protocol until it is complete
+            with open(path, 'w') as f:
+                f.write('{"formats": {"medida"')
+            os.utime(path, ns=(1, 1))
+            self.assertIs(ProtobinLoader(path), reloaded)
+            self.assertEqual(ProtobinLoader.get_stats()['reload_errors'], 1)
+            # it is not retried until the file changes again
+            self.assertIs(ProtobinLoader(path), reloaded)
+            self.assertEqual(ProtobinLoader.get_stats()['reloads'], 2)
+            js['formats']['medida']['fields']['id']['bytes'] = 4
+            with open(path, 'w') as f:
+                json.dump(js, f)
+            os.utime(path, ns=(2, 2))
+            self.assertEqual(ProtobinLoader(path).encode({'id': 1}, 'medida'), b'M=\x00\x00\x00\x01')
+
+
+class ParallelTest(unittest.TestCase):
+
+    def test_decode_parallel(self):
+        protocol = Protocol(file='codec8.json')
+        fields = protocol.formats['report'].output_fields
+        frames = [protocol.encode(sample_data(fields, size), 'report') for size in range(1, 20)]
+        expected = protocol.decode_many(frames)
+        self.assertEqual(protocol.decode_parallel(frames, workers=2, chunksize=3), expected)
+        protocol = Protocol(js=protocol.definition)
+        with ParallelDecoder(protocol, workers=2, chunksize=4) as decoder:
+            self.assertEqual(list(decoder.decode(iter(frames))), expected)
+            results = list(decoder.decode(map(memoryview, frames), columnar=True))
+        expected = protocol.decode_many(frames, columnar=True)
+        self.assertEqual([list(data['positions']['speed']) for name, data in results],
+                         [list(data['positions']['speed']) for name, data in expected])
+
+
+class RingTest(unittest.TestCase):
+
+    def test_wrap(self):
+        ring = FrameRing(size=64)
+        try:
+            received = []
+            records = [bytes([i]) * (i % 23) for i in range(100)]
+            for record in records:
+                while not ring.put(record):
+                    received.append(bytes(ring.get()))
+                    ring.release()
+            while len(ring):
+                received.append(bytes(ring.get()))
+                ring.release()
+            self.assertEqual(received, records)
+            self.assertIsNone(ring.get())
+            with self.assertRaises(ValueError):
+                ring.put(bytes(61))
+        finally:
+            ring.close()
+
+    def test_large_record(self):
+        ring = FrameRing(size=4096)
+        try:
+            for size in (100, 2044, 2044):
+                # the last one does not fit at the end, it wraps to the start of the empty ring
+                self.assertTrue(ring.put(bytes(size)))
+                self.assertEqual(len(ring.get()), size)
+                ring.release()
+            # bigger than half the ring, it fits neither at the end nor before the position of an empty ring
+            with self.assertRaises(ValueError):
+                ring.put(bytes(2100))
+        finally:
+            ring.close()
+
+    def test_pipeline(self):
+        protocol = Protocol(file='codec8.json')
+        fields = protocol.formats['report'].output_fields
+        frames = [protocol.encode(sample_data(fields, size), 'report') for size in range(6)]
+        frames[3] = frames[3][:-1] + b'\x00'
+        # a valid CRC with a timestamp out of the range of datetime
+        payload = bytearray(frames[2][8:-protocol.crc_size])
+        payload[2:8] = b'\xff' * 6
+        frames.append(frames[2][:8] + payload + protocol.crc16(payload).to_bytes(protocol.crc_size, protocol.crc_byteorder))
+        frames.append(frames[0])
+        with DecodePipeline(protocol, lanes=2, size=4096) as pipeline:
+            for i, binary in enumerate(frames):
+                pipeline.send(binary, lane=i % 2)
+            pipeline.stop(0)
+            pipeline.stop(1)
+            results = [pipeline.receive(lane=i % 2, timeout=10) for i in range(len(frames))]
+            self.assertIsNone(pipeline.receive(lane=0, timeout=10))
+        self.assertIsInstance(results[3], CRCError)
+        self.assertIsInstance(results[6], ValueError)
+        self.assertEqual(results[:3] + results[4:6] + results[7:],
+                         protocol.decode_many(frames[:3] + frames[4:6] + frames[7:]))
+
+
+class CaptureTest(unittest.TestCase):
+
+    def test_write_read(self):
+        protocol = Protocol(file='codec8.json')
+        fields = protocol.formats['report'].output_fields
+        frames = [protocol.encode(sample_data(fields, size % 4), 'report') for size in range(20)]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'capture.bin')
+            with CaptureWriter(path, protocol, sync_every=3, buffer_size=256) as writer:
+                for size in range(20):
+                    writer.write(sample_data(fields, size % 4), 'report')
+            with CaptureReader(path, protocol) as reader:
+                self.assertEqual(len(reader), 20)
+                self.assertEqual(reader[-1], protocol.decode(frames[-1]))
+                self.assertEqual(reader.frame(3), frames[3])
+                self.assertEqual(list(reader), protocol.decode_many(frames))
+            self.assertTrue(os.path.exists(path + '.idx'))
+            with open(path, 'ab') as f:
+                f.write(frames[0] + frames[1][:10])
+            with CaptureReader(path, protocol) as reader:
+                self.assertEqual(len(reader), 21)
+                self.assertEqual(reader[20], protocol.decode(frames[0]))
+                with self.assertRaises(IndexError):
+                    reader[21]
+
+    def test_replaced_capture(self):
+        protocol = Protocol(file='codec8.json')
+        fields = protocol.formats['report'].output_fields
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'capture.bin')
+            with open(path, 'wb') as f:
+                f.write(protocol.encode(sample_data(fields, 3), 'report') * 2)
+            CaptureReader(path, protocol).close()
+            with open(path, 'wb') as f:
+                f.write(protocol.encode(sample_data(fields, 1), 'report') * 5)
+            with CaptureReader(path, protocol) as reader:
+                self.assertEqual(len(reader), 5)
+
+    def test_corrupted_index(self):
+        protocol = Protocol(file='codec8.json')
+        fields = protocol.formats['report'].output_fields
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'capture.bin')
+            with open(path, 'wb') as f:
+                f.write(protocol.encode(sample_data(fields, 2), 'report') * 3)
+            CaptureReader(path, protocol).close()
+            with open(path + '.idx', 'rb') as f:
+                index = f.read()
+            for corrupted in (index[:10], index[:-3], index[:16]):
+                with open(path + '.idx', 'wb') as f:
+                    f.write(corrupted)
+                with CaptureReader(path, protocol) as reader:
+                    self.assertEqual(len(reader), 3)
+            with open(path + '.idx', 'rb') as f:
+                self.assertEqual(f.read(), index)
+
+    def test_unframed_formats(self):
+        protocol = Protocol(file='codec8.json')
+        login = protocol.encode({'serial': '356307042441013'}, 'login')
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'capture.bin')
+            with CaptureWriter(path, protocol) as writer:
+                for key in ('login', 'status3'):
+                    with self.assertRaises(InputError):
+                        writer.write({'serial': '356307042441013', 'status': 'E'}, key)
+                with self.assertRaises(InputError):
+                    writer.write_frame(login)
+                writer.write(sample_data(protocol.formats['report'].output_fields, 1), 'report')
+            with CaptureReader(path, protocol) as reader:
+                self.assertEqual(len(reader), 1)
+
+
+class LazyTest(unittest.TestCase):
+
+    def test_same_data(self):
+        protocol = Protocol(file='codec8.json')
+        for size in (0, 1, 4):
+            binary = protocol.encode(sample_data(protocol.formats['report'].output_fields, size), 'report')
+            name, data = protocol.decode(binary)
+            name, view = protocol.decode(binary, lazy=True)
+            self.assertIsInstance(view, RecordView)
+            self.assertEqual(view, data)
+            self.assertEqual(view.to_dict(), data)
+
+    def test_access(self):
+        protocol = Protocol(file='codec8.json')
+        data = sample_data(protocol.formats['report'].output_fields, 3)
+        data['positions'][-1]['lat'] = -12.5
+        data['#reports'] = 3
+        name, view = protocol.decode(protocol.encode(data, 'report'), lazy=True)
+        self.assertEqual(view['#reports'], 3)
+        positions = view['positions']
+        self.assertIsInstance(positions, ArrayView)
+        self.assertEqual(positions[-1]['lat'], -12.5)
+        self.assertIs(view['positions'], positions)
+        self.assertIs(positions[-1], positions[2])
+        self.assertEqual(len(positions[0]['events4b']), 2)
+
+    def test_no_cache(self):
+        protocol = Protocol(file='codec8.json')
+        data = sample_data(protocol.formats['report'].output_fields, 3)
+        name, view = protocol.decode(protocol.encode(data, 'report'), lazy=True, lazy_cache=False)
+        self.assertIsNot(view['positions'], view['positions'])
+        self.assertEqual(view['positions'][1], data['positions'][1])
+        self.assertEqual(view.values, {})
+        self.assertEqual(view.to_dict(), protocol.decode(protocol.encode(data, 'report'))[1])
+
+    def test_flags_and_errors(self):
+        protocol = Protocol(js={'formats': {'medida': {'fields': {
+            'a,b,c': {'type': 'flags'},
+            'name': {'type': 'string'},
+            'id': {'bytes': 2, 'type': 'unsigned'}}}}})
+        binary = protocol.encode({'a': True, 'b': False, 'c': True, 'name': 'abc', 'id': 7}, 'medida')
+        view = protocol.formats['medida'].decode(binary, lazy=True)
+        self.assertEqual((view['c'], view['id'], view['name']), (True, 7, 'abc'))
+        with self.assertRaises(DecodeError):
+            protocol.formats['medida'].decode(binary[:-1], lazy=True)
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_report(self):
+        protocol = Protocol(file='codec8.json')
+        binary = protocol.encode(sample_data(protocol.formats['report'].output_fields, 4), 'report')
+        name, data = protocol.decode(binary)
+        name, projected = protocol.decode(binary, fields=['positions.time', 'positions.lat', 'positions.lng'])
+        self.assertEqual(projected, {'positions': [{k: p[k] for k in ('time', 'lat', 'lng')}
+                                                   for p in data['positions']]})
+        name, projected = protocol.decode(binary, fields=['#reports', 'positions.lat', 'positions'])
+        self.assertEqual(projected, {'positions': data['positions'], '#reports': data['#reports']})
+
+    def test_skips(self):
+        protocol = Protocol(js={'formats': {'medida': {'fields': {
+            'a,b,c': {'type': 'flags'},
+            'name': {'type': 'string'},
+            'id': {'bytes': 2, 'type': 'unsigned'},
+            'value': {'bytes': 4, 'type': 'signed'}}}}})
+        binary = protocol.encode({'a': True, 'b': False, 'c': True, 'name': 'abc', 'id': 7, 'value': -3}, 'medida')
+        format = protocol.formats['medida']
+        self.assertEqual(format.decode(binary, fields=['c', 'value']), {'c': True, 'value': -3})
+        self.assertEqual(format.decode(binary, fields=['id']), {'id': 7})
+        with self.assertRaises(InputError):
+            format.decode(binary, fields=['nombre'])
+        with self.assertRaises(InputError):
+            format.decode(binary, fields=['name.first'])
+        with self.assertRaises(DecodeError):
+            format.decode(binary[:-1], fields=['id'])
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_records(self):
+        protocol = Protocol(file='codec8.json')
+        binary = protocol.encode(sample_data(protocol.formats['report'].output_fields, 3), 'report')
+        name, data = protocol.decode(binary)
+        for kind in ('slots', 'tuple'):
+            name, record = protocol.decode(binary, records=kind)
+            self.assertEqual(type(record).__name__, 'Report')
+            self.assertEqual(record.positions[0].n_events, data['positions'][0]['#events'])
+            self.assertEqual(record.positions[0]['#events'], data['positions'][0]['#events'])
+            self.assertEqual(record.to_dict(), data)
+            self.assertEqual(protocol.encode(record, 'report'), binary)
+            start, end = protocol.check_frame(binary)
+            format, start = protocol.get_payload_format(binary, start, end)
+            for size in (1, 3, 12):
+                with self.assertRaises(DecodeError):
+                    format.decode(binary[:end - size], start, records=kind)
+        name, record = protocol.decode(binary, records='tuple')
+        self.assertIsInstance(record, tuple)
+        self.assertEqual(record[1], data['#reports'])
+
+    def test_flags(self):
+        protocol = Protocol(js={'formats': {'medida': {'fields': {
+            'a,b,c': {'type': 'flags'},
+            'class': {'bytes': 2, 'type': 'unsigned'},
+            'd,e': {'type': 'flags'}}}}})
+        binary = protocol.encode({'a': True, 'b': False, 'c': True, 'class': 7, 'd': False, 'e': True}, 'medida')
+        record = protocol.formats['medida'].decode(binary, records='slots')
+        self.assertEqual((record.a, record.c, record.f_class, record.d, record.e), (True, True, 7, False, True))
+        self.assertEqual(protocol.encode(record, 'medida'), binary)
+        with self.assertRaises(ValueError):
+            protocol.formats['medida'].decode(binary, records='dict')
+
+
+class SizeTest(unittest.TestCase):
+
+    def test_sizes(self):
+        client = Protocol(file='teltonika.json', server=None)
+        self.assertEqual(client.formats['report_ack'].size, 4)
+        status = client.formats['status3']
+        self.assertEqual((status.min_size, status.max_size, status.size), (40, 1570, None))
+        report = client.formats['report']
+        self.assertEqual(report.min_size, 2)
+        for size in (0, 3):
+            data = sample_data(report.output_fields, size)
+            self.assertEqual(report.size_of(data), len(report.encode(data)))
+            self.assertEqual(client.size_of(data, 'report'), len(client.encode(data, 'report')))
+        data = {'status': 'E', 'direction': 'A', 'delay': -200, 'datero_bus_0': 70000, 'datero_dif_0': 3}
+        self.assertEqual(client.size_of(data, 'status3'), len(client.encode(data, 'status3')))
+
+    def test_array_fixed_string(self):
+        # a fixed string shorter than its bytes is encoded without padding
+        protocol = Protocol(js={'formats': {'lista': {'header': 'L', 'fields': {'items': {'type': 'array', 'array': {
+            'id': {'type': 'unsigned', 'bytes': 2}, 'code': {'type': 'unsigned', 'bytes': 1},
+            'name': {'type': 'string', 'bytes': 8}}}}}}})
+        data = {'items': [{'id': 1, 'code': 2, 'name': 'abc'}, {'id': 2, 'code': 3, 'name': 'abcdefghij'}]}
+        lista = protocol.formats['lista']
+        self.assertEqual(lista.size_of(data), len(lista.encode(data)))
+
+    def test_stream_waits_min_size(self):
+        client = Protocol(file='teltonika.json', server=None)
+        decoder = client.stream_decoder()
+        binary = StreamTest.status
+        self.assertEqual(decoder.feed(binary[:20]), [])
+        self.assertEqual(decoder.feed(binary[20:]), [('status1', client.decode(binary)[1])])
+        self.assertEqual(decoder.errors, 0)
+
+
+class PreparedTest(unittest.TestCase):
+
+    def test_update(self):
+        for backend in ('crcmod', 'table'):
+            client = Protocol(file='teltonika.json', server=None, crc_backend=backend)
+            data = {'status': 'E', 'direction': 'A', 'next_next_control': 'IQUITOS', 'next_next_time': '14:05',
+                    'next_control': 'LOBATO', 'next_time': '14:10', 'delay': -20, 'datero_bus_-1': 12, 'datero_dif_-1': 3}
+            message = client.prepare(data, 'status3')
+            self.assertEqual(message.encode(), client.encode(data, 'status3'))
+            message.update({'datero_bus_-1': 7000}, delay=35)
+            data.update({'datero_bus_-1': 7000, 'delay': 35})
+            self.assertEqual(message.encode(), client.encode(data, 'status3'))
+            message.update(next_control='IGLESIA DE SAN JUAN', next_time='15:20')
+            data.update(next_control='IGLESIA DE SAN JUAN', next_time='15:20')
+            self.assertEqual(message.encode(), client.encode(data, 'status3'))
+            self.assertEqual(client.decode(message.encode())[1]['next_control'], 'IGLESIA DE SAN JUAN')
+            with self.assertRaises(InputError):
+                message.update(speed=3)
+            self.assertEqual(message.encode(), client.encode(data, 'status3'))